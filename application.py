@@ -1,10 +1,8 @@
 __author__ = 'Wojciech Urbanski'
 import os
-from system import *
-from blocks import *
+from scenario import pm_system, mse
+from signals import Signal
 import numpy as np
-import matplotlib.pyplot as plt
-from matplotlib import rc
 
 
 def finput(prompt):
@@ -21,14 +19,23 @@ def finput(prompt):
 class PMApplication():
     _output_dir = "output"
 
-    def __init__(self):
+    def __init__(self, headless=False, jobs=None, scratch=False):
+        # Headless mode only saves the figures, rendering them in worker processes
+        self._headless = headless
+        self._jobs = jobs
+        # Block outputs are kept in memory-mapped files under output/scratch instead of RAM
+        self._scratch_dir = os.path.join(self._output_dir, "scratch") if scratch else None
         self._setup()
         self._setup_environment()
 
     def _setup_environment(self):
         if not os.path.exists(self._output_dir):
             os.makedirs(self._output_dir)
-        rc('font', family='Arial')
+        # matplotlib is imported here and not at module level, headless runs never load pyplot
+        import matplotlib
+        if self._headless:
+            matplotlib.use('Agg')
+        matplotlib.rc('font', family='Arial')
         self._fft_limit = -200
 
     def _setup(self):
@@ -95,32 +102,24 @@ class PMApplication():
         self._setup()
         self._print_parameters()
         print("Ustawianie systemu bloków...")
-        self._config = SystemConfiguration(self._simulation_time, self._sample_freq)
-
-        blocks_list = [
-                       # NoiseGeneratorBlock(self._config, high_freq=self._modulator_freq),
-                       SineGeneratorBlock(self._config, self._modulator_freq),
-                       PhaseModulatorBlock(self._config, self._carrier_frequency,
-                                           self._carrier_amplitude, self._phase_dev),
-                       AWGNChannelBlock(self._config, snr=self._snr),
-                       BandPassFilterBlock(self._config, low_freq=0.9*(self._carrier_frequency - self._BW/2),
-                                           high_freq=1.1*(self._carrier_frequency + self._BW/2)),
-                       PhaseDemodulatorBlock(self._config, frequency=self._carrier_frequency,
-                                             deviation=self._phase_dev)]
-
-        self._config.add_blocks(blocks_list)
-
-        self._config.connect_blocks()
+        self._config = pm_system(self._modulator_freq, self._phase_dev, self._carrier_frequency,
+                                 self._carrier_amplitude, self._snr, sample_freq=self._sample_freq,
+                                 simulation_time=self._simulation_time, scratch_dir=self._scratch_dir,
+                                 verbose=True)
         self._config.list_blocks()
 
-        self._plot_modulator()
-        self._plot_outputs()
-        self._plot_input_fft()
-        self._plot_spectrograms()
+        if self._headless:
+            self._render_headless()
+        else:
+            self._plot_modulator()
+            self._plot_outputs()
+            self._plot_input_fft()
+            self._plot_spectrograms()
 
         print("Rzeczywisty SNR: ", self._config.blocks[2].get_snr())
 
     def _plot_outputs(self):
+        import matplotlib.pyplot as plt
         signal_plot, subplots = plt.subplots(len(self._config.blocks), figsize=(8, 12))
         signal_plot.suptitle("Przebiegi czasowe sygnału", fontsize="x-large")
         for i, subplot in enumerate(subplots):
@@ -137,6 +136,7 @@ class PMApplication():
         signal_plot.savefig(os.path.join(self._output_dir, "signal.png"))
 
     def _plot_input_fft(self):
+        import matplotlib.pyplot as plt
         fft_plot, subs = plt.subplots(len(self._config.blocks), figsize=(8, 12))
         fft_plot.suptitle("Wykresy widm Fouriera", fontsize="x-large")
         for i, subplot in enumerate(subs):
@@ -161,6 +161,7 @@ class PMApplication():
         fft_plot.savefig(os.path.join(self._output_dir, "spectrum.png"))
 
     def _plot_modulator(self):
+        import matplotlib.pyplot as plt
         signal_plot = plt.figure(figsize=(8, 4))
         plt.title("Porównanie sygnału wejściowego i wyjściowego", fontsize="x-large")
         plt.hold(True)
@@ -177,28 +178,61 @@ class PMApplication():
         plt.ylim(-1.1, 1.1)
         plt.show()
         signal_plot.savefig(os.path.join(self._output_dir, "signal_compare.png"))
-        print("MSE: ", np.mean((values_in - values_out)**2))
+        print("MSE: ", mse(self._config))
 
     def _plot_spectrograms(self):
+        import matplotlib.pyplot as plt
+        import rendering
+        xlim = (self._simulation_time/10, self._simulation_time/10 + 2/self._modulator_freq)
+        ylim = (0, self._carrier_frequency + 10 * self._BW)
         spectrogram_plot, subplots = plt.subplots(3, figsize=(8, 12))
         plt.suptitle("Spektrogramy", fontsize="large")
-        subplots[0].specgram(self._config.blocks[0].output.signal, Fs=self._sample_freq)
-        subplots[0].set_title("na wyjściu generatora")
-        subplots[1].specgram(self._config.blocks[2].output.signal, Fs=self._sample_freq)
-        subplots[1].set_title("na wyjściu kanału AWGN")
-        subplots[2].specgram(self._config.blocks[-1].output.signal, Fs=self._sample_freq)
-        subplots[2].set_title("na wyjściu układu")
+        blocks = self._config.blocks
+        for subplot, (title, block) in zip(subplots, (("na wyjściu generatora", blocks[0]),
+                                                      ("na wyjściu kanału AWGN", blocks[2]),
+                                                      ("na wyjściu układu", blocks[-1]))):
+            # Only the frames in view are computed, not the STFT of the whole output
+            frames, extent = rendering.specgram_slice(block.output, xlim, ylim)
+            subplot.imshow(frames, origin='lower', aspect='auto', extent=extent)
+            subplot.set_title(title)
         spectrogram_plot.set_tight_layout({"rect": (0, 0, 1, 0.95)})
         for subplot in subplots:
             subplot.set_xlabel("czas [s]")
             subplot.set_ylabel("częstotliwość [Hz]")
             subplot.axis('tight')
-            subplot.set_ylim(0, self._carrier_frequency + 10 * self._BW)
-            subplot.set_xlim(self._simulation_time/10, self._simulation_time/10 + 2/self._modulator_freq)
+            subplot.set_ylim(*ylim)
+            subplot.set_xlim(*xlim)
             subplot.grid()
         plt.show()
         spectrogram_plot.savefig(os.path.join(self._output_dir, "spectrogram.png"))
 
+    def _render_headless(self):
+        import rendering
+        blocks = self._config.blocks
+        xlim = (self._simulation_time/10, self._simulation_time/10 + 2/self._modulator_freq)
+        # Only the reduced, visible part of every signal is passed to the rendering processes
+        signals = [(block.name,) + rendering.envelope(block.output, xlim) for block in blocks]
+        spectra = [(block.name,) + rendering.spectrum_envelope(block.output, (0, 500)) for block in blocks]
+        stop = int(np.ceil(xlim[1] * self._sample_freq)) + 1
+        error = Signal(blocks[0].output.signal[..., :stop] - blocks[-1].output.signal[..., :stop], self._sample_freq)
+        timeline, values_in = rendering.envelope(blocks[0].output, xlim)
+        _, values_out = rendering.envelope(blocks[-1].output, xlim)
+        _, values_error = rendering.envelope(error, xlim)
+        spectrograms = [(title,) + rendering.specgram_slice(block.output, xlim,
+                                                            (0, self._carrier_frequency + 10 * self._BW))
+                        for title, block in (("na wyjściu generatora", blocks[0]),
+                                             ("na wyjściu kanału AWGN", blocks[2]),
+                                             ("na wyjściu układu", blocks[-1]))]
+        path = lambda filename: os.path.join(self._output_dir, filename)
+        rendering.render_all([
+            (rendering.render_signals, (path("signal.png"), signals, xlim)),
+            (rendering.render_spectra, (path("spectrum.png"), spectra, (0, 500), (-80, 0))),
+            (rendering.render_compare, (path("signal_compare.png"), timeline, values_in, values_out, values_error,
+                                        xlim)),
+            (rendering.render_spectrograms, (path("spectrogram.png"), spectrograms, xlim,
+                                             (0, self._carrier_frequency + 10 * self._BW)))], self._jobs)
+        print("MSE: ", mse(self._config))
+
     def _print_parameters(self):
         print("Szybkość próbkowania: %.2f samp/s" % self._sample_freq)
         print("Częstotliwość nośnej: %.2f Hz" % self._carrier_frequency)
@@ -210,4 +244,4 @@ class PMApplication():
 
 
 if __name__ == '__main__':
-    PMApplication().run()
\ No newline at end of file
+    PMApplication(headless=not os.environ.get('DISPLAY')).run()
\ No newline at end of file
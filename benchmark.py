@@ -0,0 +1,206 @@
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from system import SystemConfiguration
+from blocks import SineGeneratorBlock, PhaseModulatorBlock, AWGNChannelBlock, BandPassFilterBlock, \
+    PhaseDemodulatorBlock, NoiseGeneratorBlock
+
+__author__ = 'Wojciech Urbański'
+
+SAMPLE_FREQUENCY = 6400
+CARRIER_FREQUENCY = 100
+BLOCKS = ["SineGeneratorBlock", "PhaseModulatorBlock", "AWGNChannelBlock", "BandPassFilterBlock",
+          "PhaseDemodulatorBlock", "NoiseGeneratorBlock", "chain"]
+# Only the band-pass filter is parametrised by order, other blocks use the default order of 5
+ORDERED_BLOCKS = ("BandPassFilterBlock",)
+DEFAULT_ORDER = 5
+# Entry points which should start without SciPy and matplotlib, these are imported on first use
+HEADLESS_MODULES = ["main", "sweep", "scenario", "system", "blocks", "application"]
+HEAVY_MODULES = ["scipy", "matplotlib"]
+IMPORT_BUDGET_MS = 400
+
+
+def _chain(length, order):
+    config = SystemConfiguration(length / SAMPLE_FREQUENCY, SAMPLE_FREQUENCY)
+    config.add_blocks([SineGeneratorBlock(config, 10),
+                       PhaseModulatorBlock(config, CARRIER_FREQUENCY, 1, 2),
+                       AWGNChannelBlock(config, snr=15, seed=0),
+                       BandPassFilterBlock(config, low_freq=0.9 * (CARRIER_FREQUENCY - 12),
+                                           high_freq=1.1 * (CARRIER_FREQUENCY + 12), order=order),
+                       PhaseDemodulatorBlock(config, frequency=CARRIER_FREQUENCY, deviation=2)])
+    return config
+
+
+def _measure(case):
+    """
+    Runs single benchmark case, called in a fresh worker process so peak RSS belongs to this case only.
+    """
+    name, length, order, repeat = case
+    # SciPy is imported on first use by the blocks, importing it here keeps the import out of the timings
+    import scipy.fft
+    import scipy.signal
+    timings = []
+    for _ in range(repeat):
+        config = _chain(length, order)
+        if name == "chain":
+            start = time.perf_counter()
+            config.connect_blocks(verbose=False)
+            config.blocks[-1].output
+        else:
+            if name == "NoiseGeneratorBlock":
+                block = NoiseGeneratorBlock(config, high_freq=10, seed=0)
+            else:
+                config.connect_blocks(verbose=False)
+                block = [block for block in config.blocks if type(block).__name__ == name][0]
+                # Inputs are prepared beforehand, only the block itself is timed
+                block.input
+            start = time.perf_counter()
+            block._process()
+        timings.append(time.perf_counter() - start)
+    best = min(timings)
+    return {"block": name, "length": length, "order": order, "seconds": best, "mean_seconds": float(np.mean(timings)),
+            "samples_per_second": length / best,
+            "peak_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss}
+
+
+def cases(lengths, orders, blocks=BLOCKS, repeat=3):
+    result = []
+    for name in blocks:
+        for length in lengths:
+            for order in (orders if name in ORDERED_BLOCKS else [DEFAULT_ORDER]):
+                # Very long signals are measured once, they take long enough
+                result.append((name, length, order, repeat if length < 10 ** 6 else 1))
+    return result
+
+
+def run(lengths, orders, blocks=BLOCKS, repeat=3):
+    results = []
+    # Every case gets its own process, one at a time, so timings and RSS are not disturbed
+    with ProcessPoolExecutor(max_workers=1, max_tasks_per_child=1) as executor:
+        for result in executor.map(_measure, cases(lengths, orders, blocks, repeat)):
+            print("%-22s %10d %3d %10.4f s %14.0f samp/s %10d kB" % (
+                result["block"], result["length"], result["order"], result["seconds"],
+                result["samples_per_second"], result["peak_rss_kb"]), file=sys.stderr)
+            results.append(result)
+    return {"python": platform.python_version(), "numpy": np.__version__, "machine": platform.machine(),
+            "sample_frequency": SAMPLE_FREQUENCY, "results": results}
+
+
+def scaling(report):
+    """
+    Exponent of time growth with length for every block and order, 1.0 means linear scaling.
+    """
+    curves = {}
+    for result in report["results"]:
+        curves.setdefault((result["block"], result["order"]), []).append((result["length"], result["seconds"]))
+    exponents = {}
+    for (name, order), points in curves.items():
+        if len(points) > 1:
+            lengths, seconds = np.log(np.array(sorted(points))).T
+            exponents["%s/%d" % (name, order)] = float(np.polyfit(lengths, seconds, 1)[0])
+    return exponents
+
+
+def compare(old, new, threshold=0.1):
+    """
+    Finds cases which got slower by more than threshold (relative samples per second) between two reports.
+    """
+    key = lambda result: (result["block"], result["length"], result["order"])
+    baseline = {key(result): result for result in old["results"]}
+    regressions = []
+    for result in new["results"]:
+        before = baseline.get(key(result))
+        if before is None:
+            continue
+        change = result["samples_per_second"] / before["samples_per_second"] - 1
+        if change < -threshold:
+            regressions.append({"block": result["block"], "length": result["length"], "order": result["order"],
+                                "change": change})
+    return regressions
+
+
+def import_time(module, repeat=3):
+    """
+    Import time of module in a fresh interpreter (best of repeat runs) and heavy modules it loaded.
+    """
+    script = ("import sys, time; start = time.perf_counter(); import %s; "
+              "print(time.perf_counter() - start); print(' '.join(name for name in %r if name in sys.modules))"
+              % (module, HEAVY_MODULES))
+    timings = []
+    for _ in range(repeat):
+        lines = subprocess.run([sys.executable, "-c", script], capture_output=True, text=True, check=True,
+                               cwd=os.path.dirname(os.path.abspath(__file__))).stdout.splitlines()
+        timings.append(float(lines[0]))
+    return {"module": module, "milliseconds": 1000 * min(timings),
+            "heavy_modules": lines[1].split() if len(lines) > 1 else []}
+
+
+def check_imports(modules=HEADLESS_MODULES, budget=IMPORT_BUDGET_MS, repeat=3):
+    """
+    Measures import time of every module, failures are modules over budget or loading SciPy or matplotlib.
+    """
+    results = [import_time(module, repeat) for module in modules]
+    failures = [result for result in results if result["milliseconds"] > budget or result["heavy_modules"]]
+    return results, failures
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark bloków systemu modulacji fazowej")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    run_parser = subparsers.add_parser("run", help="uruchom benchmark")
+    run_parser.add_argument("--min-exp", type=int, default=3, help="najkrótszy sygnał 10^n próbek")
+    run_parser.add_argument("--max-exp", type=int, default=6, help="najdłuższy sygnał 10^n próbek (do 8)")
+    run_parser.add_argument("--orders", type=int, nargs="+", default=[3, 5, 8], help="rzędy filtru")
+    run_parser.add_argument("--blocks", nargs="+", default=BLOCKS, choices=BLOCKS)
+    run_parser.add_argument("--repeat", type=int, default=3)
+    run_parser.add_argument("-o", "--output", help="plik JSON z wynikami (domyślnie stdout)")
+    compare_parser = subparsers.add_parser("compare", help="porównaj dwa pliki z wynikami")
+    compare_parser.add_argument("old")
+    compare_parser.add_argument("new")
+    compare_parser.add_argument("--threshold", type=float, default=0.1, help="dopuszczalny spadek wydajności")
+    imports_parser = subparsers.add_parser("imports", help="sprawdź czas importu modułów")
+    imports_parser.add_argument("--modules", nargs="+", default=HEADLESS_MODULES)
+    imports_parser.add_argument("--budget", type=float, default=IMPORT_BUDGET_MS, help="limit czasu importu [ms]")
+    imports_parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args(argv)
+
+    if args.command == "imports":
+        results, failures = check_imports(args.modules, args.budget, args.repeat)
+        for result in results:
+            print("%-15s %8.1f ms %s" % (result["module"], result["milliseconds"], " ".join(result["heavy_modules"])),
+                  file=sys.stderr)
+        json.dump({"budget": args.budget, "results": results, "failures": failures}, sys.stdout, indent=2)
+        print()
+        return 1 if failures else 0
+
+    if args.command == "run":
+        report = run([10 ** n for n in range(args.min_exp, args.max_exp + 1)], args.orders, args.blocks, args.repeat)
+        report["scaling"] = scaling(report)
+        if args.output:
+            with open(args.output, "w") as f:
+                json.dump(report, f, indent=2)
+        else:
+            json.dump(report, sys.stdout, indent=2)
+        return 0
+
+    with open(args.old) as f:
+        old = json.load(f)
+    with open(args.new) as f:
+        new = json.load(f)
+    regressions = compare(old, new, args.threshold)
+    json.dump({"threshold": args.threshold, "regressions": regressions}, sys.stdout, indent=2)
+    print()
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
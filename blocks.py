@@ -1,37 +1,230 @@
+import hashlib
+import math
+
 import numpy as np
-from scipy.signal import lfilter, hilbert, filtfilt
 
-from filters import butter_lowpass, butter_bandpass
+from metrics import ErrorStatistics, SEGMENT_SIZE
+from noise import NoiseStream
+from oscillator import NCO, wrap_phase
+from filters import butter_lowpass, butter_bandpass, hilbert_fir, analytic_signal, fir_analytic_signal, resample_fir
 from signals import Signal
 
 
 __author__ = 'Wojciech Urbański'
 
+# Outputs of ChannelizerBlock computed at once in batch mode
+CHANNELIZER_SEGMENT = 1024
+
+
+class Parameter(property):
+    pass
+
+
+def parameter(attribute, doc=None):
+    """
+    Property for a block parameter stored in attribute. Setting it marks the block and the blocks connected
+    after it as outdated, cached outputs of upstream blocks are reused when they are recomputed.
+    """
+    def getter(self):
+        return getattr(self, attribute)
+
+    def setter(self, value):
+        setattr(self, attribute, value)
+        self.invalidate()
+
+    return Parameter(getter, setter, doc=doc)
+
 
 class Block():
     def __init__(self, config, name="Postawowy blok"):
         self._config = config
-        self._input = Signal(np.zeros(self._config.timeline.shape), config.sample_frequency)
-        self._output = self._process()
         self._name = name
-
-    def connect(self, previous_block):
+        # Named inputs map to (block, output name) of the block connected to them
+        self._inputs = {}
+        self._next = []
+        # Outputs are computed lazily, None marks a block that has to be (re)processed
+        self._outputs = None
+        self.reset()
+
+    def connect(self, previous_block, input="input", output="output"):
+        """
+        Connects output of previous_block to the given input of this block.
+        """
         if isinstance(previous_block, Block):
-            self._input = previous_block.output
-            self._output = self._process()
+            if self._feeds(previous_block):
+                raise ValueError("Połączenie tworzy cykl w grafie bloków")
+            if input in self._inputs:
+                self._inputs[input][0]._next.remove(self)
+            self._inputs[input] = (previous_block, output)
+            previous_block._next.append(self)
+            self.invalidate()
         else:
             raise TypeError("Nieprawidłowy typ, nie można połączyć")
 
+    def _feeds(self, block):
+        # True if block is this block or is connected, directly or not, after it
+        stack = [self]
+        visited = set()
+        while stack:
+            current = stack.pop()
+            if current is block:
+                return True
+            if current not in visited:
+                visited.add(current)
+                stack.extend(current._next)
+        return False
+
+    def invalidate(self):
+        """
+        Marks output of this block and of all blocks connected after it as outdated.
+        """
+        self._outputs = None
+        for block in self._next:
+            block.invalidate()
+
+    def parameters(self):
+        """
+        Values of all parameters of the block, by name.
+        """
+        names = {name for cls in type(self).__mro__ for name, value in vars(cls).items()
+                 if isinstance(value, Parameter)}
+        return {name: getattr(self, name) for name in sorted(names)}
+
+    @property
+    def _deterministic(self):
+        # Blocks drawing from an unseeded random stream give different output on every run
+        return True
+
+    @property
+    def _stream_key(self):
+        # Identifies the random stream of the block, None for blocks not drawing random numbers
+        return None
+
+    def cache_key(self):
+        """
+        Hash identifying output of the block: its type and parameters, keys of the blocks connected to its inputs
+        and the timeline. None if the output is not reproducible, e.g. depends on an unseeded noise.
+        """
+        if not self._deterministic:
+            return None
+        upstream = []
+        for input, (block, output) in sorted(self._inputs.items()):
+            key = block.cache_key()
+            if key is None:
+                return None
+            upstream.append((input, key, output))
+        config = self._config
+        description = repr((type(self).__name__, sorted(self.parameters().items()), upstream, config.time,
+                            config.sample_frequency, config.length, str(config.dtype), config.trials,
+                            self._stream_key))
+        return hashlib.sha256(description.encode()).hexdigest()
+
+    @property
+    def upstream(self):
+        """
+        Blocks connected to inputs of this block, without repetitions.
+        """
+        blocks = []
+        for block, _ in self._inputs.values():
+            if block not in blocks:
+                blocks.append(block)
+        return blocks
+
+    @property
+    def downstream(self):
+        blocks = []
+        for block in self._next:
+            if block not in blocks:
+                blocks.append(block)
+        return blocks
+
     def _process(self):
         pass
 
+    def reset(self):
+        """
+        Resets the state carried between consecutive chunks in streaming mode.
+        """
+        pass
+
+    def close(self):
+        """
+        Ends streaming mode, releasing files, connections and threads held by the block.
+        """
+        pass
+
+    def process_chunk(self, chunk):
+        """
+        Processes one chunk of input samples, carrying block state over to the next call.
+
+        :rtype : numpy.ndarray
+        """
+        chunk = np.asarray(chunk)
+        chunk = chunk.astype(self._config.complex_dtype if np.iscomplexobj(chunk) else self._config.dtype, copy=False)
+        if self._config.hooks:
+            return self._call_hooked("chunk", self._process_chunk, chunk, chunk)
+        return self._process_chunk(chunk)
+
+    def _process_chunk(self, chunk):
+        raise NotImplementedError("Blok nie obsługuje trybu strumieniowego")
+
+    def _call_hooked(self, mode, process, data, *args):
+        # Hooks see input and output arrays of a single invocation, upstream blocks are evaluated beforehand
+        # so they are not accounted to this block
+        hooks = self._config.hooks
+        for hook in hooks:
+            hook.pre_process(self, mode, data)
+        result = process(*args)
+        for hook in reversed(hooks):
+            output = result.get("output") if isinstance(result, dict) else result
+            hook.post_process(self, mode, data, output.signal if isinstance(output, Signal) else output)
+        return result
+
+    def _signal(self, array):
+        # Every block output uses precision of the configuration
+        dtype = self._config.complex_dtype if np.iscomplexobj(array) else self._config.dtype
+        return Signal(array.astype(dtype, copy=False), self.sample_frequency)
+
+    @property
+    def input_frequency(self):
+        """
+        Sample frequency of the signal connected to the input, the system sample frequency if nothing is connected.
+        """
+        if "input" in self._inputs:
+            return self._inputs["input"][0].sample_frequency
+        return self._config.sample_frequency
+
+    @property
+    def sample_frequency(self):
+        """
+        Sample frequency of the outputs, the same as of the input unless the block changes the sample rate.
+        """
+        return self.input_frequency
+
+    def output_length(self, length):
+        """
+        Number of output samples produced from length input samples.
+        """
+        return length
+
     @property
     def input(self):
         """
 
         :rtype : Signal
         """
-        return self._input
+        return self.get_input("input")
+
+    def get_input(self, name="input"):
+        """
+        Signal connected to the named input, zeros if nothing is connected to it.
+
+        :rtype : Signal
+        """
+        if name not in self._inputs:
+            return Signal(np.zeros((self._config.length,), self._config.dtype), self._config.sample_frequency)
+        block, output = self._inputs[name]
+        return block.get_output(output)
 
     @property
     def output(self):
@@ -39,7 +232,58 @@ class Block():
 
         :rtype : Signal
         """
-        return self._output
+        return self.get_output("output")
+
+    def get_output(self, name="output"):
+        """
+
+        :rtype : Signal
+        """
+        try:
+            return self.outputs[name]
+        except KeyError:
+            raise KeyError("Blok %s nie ma wyjścia %s" % (self.name, name)) from None
+
+    @property
+    def outputs(self):
+        """
+        All named outputs of the block. _process() returns either a single Signal, used as "output",
+        or a dictionary of named signals.
+        """
+        if self._outputs is None:
+            cache = self._config.cache
+            key = self.cache_key() if cache is not None else None
+            # Outputs found in the cache are used without evaluating any of the upstream blocks
+            self._outputs = cache.get(key, self.sample_frequency) if key is not None else None
+            if self._outputs is None:
+                self._outputs = self._evaluate()
+                if key is not None:
+                    self._outputs = cache.put(key, self._outputs)
+        return self._outputs
+
+    def _evaluate(self):
+        if self._config.hooks:
+            # Upstream blocks are evaluated before the hooks, so their time is not accounted to this block
+            for block in self.upstream:
+                block.outputs
+            data = self.get_input("input").signal if "input" in self._inputs else None
+            outputs = self._call_hooked("process", self._process, data)
+        else:
+            outputs = self._process()
+        if not isinstance(outputs, dict):
+            outputs = {"output": outputs}
+        return {name: self._config.store(self, signal, "" if name == "output" else "_" + name)
+                for name, signal in outputs.items()}
+
+    def set_output(self, signal, name="output"):
+        """
+        Replaces output of the block with already computed signal, blocks connected after it are invalidated.
+        """
+        for block in self._next:
+            block.invalidate()
+        if self._outputs is None:
+            self._outputs = {}
+        self._outputs[name] = signal
 
     @property
     def name(self):
@@ -47,92 +291,640 @@ class Block():
 
 
 class SineGeneratorBlock(Block):
-    def __init__(self, config, frequency=1, start_ph=0, name="Generator sinusoidalny"):
-        self.frequency = frequency
+    """
+    Sine of the given frequency from a numerically controlled oscillator. With lut_bits set, samples are read
+    from a sine table of 2**lut_bits entries, faster but with phase truncation spurs about 6 dB per bit down.
+    """
+    def __init__(self, config, frequency=1, start_ph=0, lut_bits=None, name="Generator sinusoidalny"):
+        self._frequency = frequency
         self._start_ph = start_ph
+        self._lut_bits = lut_bits
         super().__init__(config, name)
 
+    frequency = parameter("_frequency")
+    start_phase = parameter("_start_ph")
+    lut_bits = parameter("_lut_bits")
+
+    def _oscillator(self):
+        return NCO(self._frequency, self._config.sample_frequency, self._start_ph, self._lut_bits)
+
+    def _sine(self, oscillator, length):
+        # One row per frequency when given an array of them
+        return oscillator.sin(length, out=np.empty(np.shape(self._frequency) + (length,), self._config.dtype))
+
     def _process(self):
-        return Signal(np.sin(2 * np.pi * self.frequency * self._config.timeline + self._start_ph),
-                      self._config.sample_frequency)
+        return self._signal(self._sine(self._oscillator(), self._config.length))
+
+    def reset(self):
+        self._nco = self._oscillator()
+
+    def _process_chunk(self, chunk):
+        return self._sine(self._nco, chunk.shape[-1])
 
-    def connect(self, previous_block):
+    def connect(self, previous_block, input="input", output="output"):
         pass
 
 
 class PhaseModemBlock(Block):
+    """
+    Base of the phase modulator and demodulator. frequency, amplitude and deviation may be arrays with one value
+    per carrier, then the signals have a channel axis before the samples and all carriers are processed at once.
+    """
     def __init__(self, config, frequency=1, amplitude=1, deviation=1, name="Modulator fazowy"):
         self._frequency = frequency
         self._amplitude = amplitude
         self._deviation = deviation
         super().__init__(config, name)
 
+    frequency = parameter("_frequency")
+    amplitude = parameter("_amplitude")
+    deviation = parameter("_deviation")
+
+    @property
+    def channels(self):
+        """
+        Number of carriers, 0 for a single carrier given as a scalar.
+        """
+        return len(self._frequency) if np.ndim(self._frequency) else 0
+
+    def _per_channel(self, value):
+        # Array parameters hold one value per carrier, on the channel axis before the samples
+        if np.ndim(value) == 0:
+            return value
+        return np.asarray(value, self._config.dtype)[:, None]
+
+    def _check_channels(self, x):
+        if self.channels and x.shape[-2:-1] != (self.channels,):
+            raise ValueError("Blok ma %d nośnych, sygnał musi mieć tyle samo kanałów na przedostatniej osi, "
+                             "a ma kształt %s." % (self.channels, x.shape))
+
+    def _carrier(self, phase=0.0):
+        return NCO(self._frequency, self.sample_frequency, phase)
+
+    def reset(self):
+        self._nco = self._carrier()
+
 
 class PhaseModulatorBlock(PhaseModemBlock):
+    """
+    Phase modulator. With several carriers the input holds one modulating signal per carrier and the output
+    is their frequency-division multiplex, the sum of all modulated carriers.
+    """
+    def _modulate(self, x, carrier):
+        self._check_channels(x)
+        # Computed in place in the output array, the carrier phase is added block by block
+        y = x * self._per_channel(self._deviation)
+        carrier.add_phase(y)
+        np.sin(y, out=y)
+        np.multiply(y, self._per_channel(self._amplitude), out=y)
+        return y.sum(axis=-2) if self.channels else y
+
     def _process(self):
-        return Signal(self._amplitude * np.sin(2 * np.pi * self._frequency * self._config.timeline +
-                                               self._deviation * self.input.signal), self._config.sample_frequency)
+        return self._signal(self._modulate(self.input.signal, self._carrier()))
+
+    def _process_chunk(self, chunk):
+        return self._modulate(chunk, self._nco)
 
 
 class PhaseDemodulatorBlock(PhaseModemBlock):
+    """
+    Phase demodulator. In batch mode the output is aligned with the input. In streaming mode a real (passband)
+    input goes through a FIR Hilbert transformer and the output is delayed by delay samples, zero until
+    the first input sample leaves the filter; complex (baseband) input is not delayed. Causal filters
+    in front of the demodulator add their own delay in streaming mode, about FilterBlock.group_delay() at the carrier.
+    """
+    def __init__(self, config, frequency=1, amplitude=1, deviation=1, method='fft', hilbert_taps=513,
+                 name="Demodulator fazowy"):
+        # 'fft' builds the analytic signal with one FFT pair, 'fir' uses overlap-add FIR Hilbert for long inputs
+        if method not in ('fft', 'fir'):
+            raise ValueError("Nieznana metoda demodulacji: %s" % method)
+        self._method = method
+        self._hilbert_taps = hilbert_taps
+        self._hilbert = None
+        self._delay = (hilbert_taps - 1) // 2
+        super().__init__(config, frequency, amplitude, deviation, name)
+
+    method = parameter("_method")
+
+    def parameters(self):
+        return dict(super().parameters(), hilbert_taps=self._hilbert_taps)
+
+    @property
+    def delay(self):
+        """
+        Delay in samples of the streaming output of a real input, the group delay of the Hilbert transformer.
+        """
+        return self._delay
+
     def _process(self):
-        # Create analytic signal using Hilbert transform
-        # Using hilbert twice changes signal to -signal
-        h_signal = -hilbert(hilbert(self.input.signal).imag)
-        # Angle of analytic signal corresponds to phase of given signal
-        phase = np.unwrap(np.angle(h_signal))
-        # We reduce the phase value by linear component omega*t
-        output = (phase - 2 * np.pi * self._frequency * self._config.timeline) / self._deviation
+        x = self.input.signal
+        self._check_channels(x)
+        if np.iscomplexobj(x):
+            # Complex input is already mixed down to baseband (BasebandMixerBlock, ChannelizerBlock),
+            # only its angle is needed
+            phase = np.angle(1j * x)
+            if self._wrapped:
+                phase = np.unwrap(phase)
+            return self._signal(phase / self._per_channel(self._deviation))
+        # Create analytic signal using Hilbert transform, rotated by 90 degrees
+        # to match the sine carrier - same as -hilbert(hilbert(x).imag)
+        if self._method == 'fft':
+            h_signal = 1j * analytic_signal(x, remove_dc=True)
+        else:
+            h_signal = 1j * fir_analytic_signal(x, self._hilbert_taps)
+        # Angle of analytic signal corresponds to phase of given signal, reduced by the carrier phase
+        phase = np.angle(h_signal)
+        self._carrier().add_phase(phase, -1)
+        output = np.unwrap(wrap_phase(phase)) / self._per_channel(self._deviation)
         # unwrap() sometimes changes first few samples by too much, substracting mean() fixes this
         # output -= np.mean(output)
-        return Signal(output, self._config.sample_frequency)
+        return self._signal(output)
+
+    def reset(self):
+        # FIR Hilbert transformer delays its output by self._delay samples,
+        # the carrier phase starts behind by the same amount
+        self._nco = self._carrier(-2 * np.pi * np.asarray(self._frequency) * self._delay / self.sample_frequency)
+        self._zi = None
+        self._history = None
+        self._warmup = self._delay
+        self._last_phase = None
+
+    def _process_chunk(self, chunk):
+        length = chunk.shape[-1]
+        if length == 0:
+            return chunk.real
+        self._check_channels(chunk)
+        if np.iscomplexobj(chunk):
+            phase = np.angle(1j * chunk)
+            if not self._wrapped:
+                return phase / self._per_channel(self._deviation)
+        else:
+            phase = self._passband_phase(chunk)
+        if self._last_phase is not None:
+            phase = np.unwrap(np.concatenate((self._last_phase, phase), axis=-1))[..., 1:]
+        else:
+            phase = np.unwrap(phase)
+        self._last_phase = phase[..., -1:]
+        return phase / self._per_channel(self._deviation)
+
+    @property
+    def _wrapped(self):
+        # Baseband phase stays within (-pi, pi) for deviation below pi. Without unwrap() a noise spike
+        # or a filter warm-up does not shift all the following samples by a multiple of 2*pi
+        return bool(np.any(np.asarray(self._deviation) >= np.pi))
+
+    def _passband_phase(self, chunk):
+        length = chunk.shape[-1]
+        if self._zi is None:
+            self._zi = np.zeros(chunk.shape[:-1] + (self._hilbert_taps - 1,), chunk.dtype)
+            self._history = np.zeros(chunk.shape[:-1] + (self._delay,), chunk.dtype)
+        from scipy.signal import lfilter
+        if self._hilbert is None:
+            self._hilbert = hilbert_fir(self._hilbert_taps).astype(self._config.dtype)
+        imag, self._zi = lfilter(self._hilbert, np.ones(1, chunk.dtype), chunk, zi=self._zi)
+        # Real part has to be delayed to match the group delay of the Hilbert filter
+        delayed = np.concatenate((self._history, chunk), axis=-1)
+        real, self._history = delayed[..., :length], delayed[..., length:]
+        # Same analytic signal as -hilbert(hilbert(x).imag), its angle reduced by the carrier phase
+        phase = np.angle(-imag + 1j * real)
+        wrap_phase(self._nco.add_phase(phase, -1))
+        # Output is zero until the first input sample leaves the delay line
+        skip = min(self._warmup, length)
+        phase[..., :skip] = 0
+        self._warmup -= skip
+        return phase
+
+
+class RandomBlock(Block):
+    """
+    Block drawing Gaussian noise. With seed set its stream is derived from the seed only, otherwise it is
+    a child of the system seed sequence, spawned when the block is created.
+    """
+    def __init__(self, config, seed=None, name="Blok losowy"):
+        self._seed = seed
+        self._seed_sequence = config.spawn_seed_sequence()
+        super().__init__(config, name)
 
+    seed = parameter("_seed")
 
-class AWGNChannelBlock(Block):
-    def __init__(self, config, snr=20, name="Kanał AWGN"):
+    @property
+    def _deterministic(self):
+        return self._seed is not None or self._config.seed is not None
+
+    @property
+    def _stream_key(self):
+        seed_sequence = self._stream_seed_sequence()
+        return seed_sequence.entropy, seed_sequence.spawn_key, self._config.bit_generator
+
+    def _stream_seed_sequence(self):
+        return self._seed_sequence if self._seed is None else np.random.SeedSequence(self._seed)
+
+    def noise_stream(self):
+        """
+        New stream of the noise of this block, starting at the beginning of the timeline.
+
+        :rtype : NoiseStream
+        """
+        return NoiseStream(self._stream_seed_sequence(), self._config.trials, self._config.bit_generator)
+
+
+class AWGNChannelBlock(RandomBlock):
+    """
+    Adds white Gaussian noise at snr dB below the power of the input. The power at every sample is estimated
+    from all samples up to it, in batch and in streaming mode alike, so the output does not depend on the chunk
+    size and a run in one piece gives the same output as a chunked one. statistics holds ErrorStatistics
+    of the noise added since the last reset().
+    """
+    def __init__(self, config, snr=20, seed=None, name="Kanał AWGN"):
         self._snr = snr
-        self._noise = np.zeros(config.timeline.shape)
+        super().__init__(config, seed, name)
+
+    snr = parameter("_snr")
+
+    def _process(self):
+        # Same computation as streaming, in segments so that temporary arrays stay short. Noise is drawn
+        # from a fresh stream, so recomputing after a parameter change gives the same realisation as a new run
+        # with the same seed; deterministic input is broadcast to every trial, only the noise differs between them
+        self.reset()
+        signal = self.input.signal
+        output = np.empty(self._config.batch_shape(signal.shape[-1]), signal.dtype)
+        for start in range(0, signal.shape[-1], SEGMENT_SIZE):
+            output[..., start:start + SEGMENT_SIZE] = self._process_chunk(signal[..., start:start + SEGMENT_SIZE])
+        return self._signal(output)
+
+    def reset(self):
+        self._stream = self.noise_stream()
+        self._shift = None
+        self.statistics = ErrorStatistics()
+
+    def _power(self, chunk):
+        # Variance of all samples up to every sample of the chunk. Sums are carried over as the first element
+        # of cumsum(), so they are added in the same order however the signal is split into chunks
+        if self._shift is None:
+            # Samples are shifted by the first one, the sums stay small for signals with an offset
+            self._shift = chunk[..., :1].astype(np.float64)
+            self._count = 0
+            self._sum = np.zeros(self._shift.shape)
+            self._square = np.zeros(self._shift.shape)
+        shifted = chunk - self._shift
+        sums = np.cumsum(np.concatenate((self._sum, shifted), axis=-1), axis=-1)[..., 1:]
+        squares = np.cumsum(np.concatenate((self._square, shifted ** 2), axis=-1), axis=-1)[..., 1:]
+        counts = np.arange(self._count + 1, self._count + chunk.shape[-1] + 1)
+        self._sum, self._square, self._count = sums[..., -1:], squares[..., -1:], counts[-1]
+        return np.maximum(squares / counts - (sums / counts) ** 2, 0)
+
+    def _process_chunk(self, chunk):
+        length = chunk.shape[-1]
+        if length == 0:
+            return chunk
+        sigma = np.sqrt(self._power(chunk)) * 10 ** (-self._snr / 20)
+        noise = self._stream.normal(length) * sigma
+        output = chunk + noise.astype(chunk.dtype, copy=False)
+        self.statistics.update(chunk, output)
+        return output
+
+    def get_snr(self):
+        """
+        Achieved SNR in dB, one value per trial. The noise is recovered from the input and the output
+        one segment at a time, it is not kept with the outputs of the block.
+        """
+        return ErrorStatistics().update(self.input.signal, self.output.signal).snr
+
+
+class FilterBlock(Block):
+    def __init__(self, config, order=5, sos=False, name="Filtr"):
+        self._order = order
+        # Second-order sections stay stable for high orders and narrow bands at high sample rates
+        self._sos = sos
         super().__init__(config, name)
 
+    order = parameter("_order")
+    sos = parameter("_sos")
+
+    def _coefficients(self, output):
+        raise NotImplementedError
+
+    @property
+    def _use_sos(self):
+        # Transfer function coefficients of narrow filters are unstable in single precision
+        return self._sos or self._config.dtype == np.float32
+
+    def _design(self):
+        # Coefficients in the precision of the configuration, so filtering does not upcast the signal
+        if self._use_sos:
+            return self._coefficients('sos').astype(self._config.dtype)
+        b, a = self._coefficients('ba')
+        return b.astype(self._config.dtype), a.astype(self._config.dtype)
+
     def _process(self):
-        var = self.input.get_energy()
-        if var > 0:
-            sigma = np.sqrt(var) * 10 ** (-self._snr / 20)
-            noise = np.random.normal(loc=0.0, scale=sigma, size=self._config.timeline.shape)
-            self._noise = Signal(noise, self._config.sample_frequency)
-            return Signal(self.input.signal + noise, self._config.sample_frequency)
+        from scipy.signal import filtfilt, sosfiltfilt
+        if self._use_sos:
+            y = sosfiltfilt(self._design(), self.input.signal)
         else:
-            self._noise = Signal(np.zeros(self._config.timeline.shape), self._config.sample_frequency)
-            return self.input
+            b, a = self._design()
+            y = filtfilt(b, a, self.input.signal)
+        return self._signal(y)
 
-    def get_snr(self):
-        mean = np.mean(self.input.signal)
-        signal_pwr = np.sum((self.input.signal - mean) ** 2)
-        noise_pwr = np.sum(self._noise.signal ** 2)
-        return 10 * np.log10(signal_pwr / noise_pwr)
+    def group_delay(self, frequency):
+        """
+        Delay in samples of the streaming output at frequency (in Hz). Batch output is filtered forwards
+        and backwards and is not delayed.
+        """
+        from scipy.signal import group_delay
+        w = [2 * np.pi * frequency / self.sample_frequency]
+        # Summed over second-order sections, group_delay() of a narrow filter in transfer function form is unreliable
+        return float(sum(group_delay((section[:3], section[3:]), w)[1][0] for section in self._coefficients('sos')))
+
+    def reset(self):
+        self._zi = None
+
+    def _process_chunk(self, chunk):
+        # filtfilt() needs the whole signal, streaming mode uses a causal filter instead
+        if chunk.shape[-1] == 0:
+            return chunk
+        from scipy.signal import lfilter, lfilter_zi, sosfilt, sosfilt_zi
+        if self._use_sos:
+            sos = self._design()
+            if self._zi is None:
+                # sosfilt() keeps the state of every trial between section and delay axes
+                zi = np.expand_dims(sosfilt_zi(sos), tuple(range(1, chunk.ndim)))
+                self._zi = zi * chunk[..., :1]
+            y, self._zi = sosfilt(sos, chunk, zi=self._zi.astype(chunk.dtype, copy=False))
+        else:
+            b, a = self._design()
+            if self._zi is None:
+                self._zi = lfilter_zi(b, a).astype(chunk.dtype) * chunk[..., :1]
+            y, self._zi = lfilter(b, a, chunk, zi=self._zi)
+        return y
 
 
-class BandPassFilterBlock(Block):
-    def __init__(self, config, low_freq=5, high_freq=10, order=5, name="Filtr dolprzepustowy"):
+class BandPassFilterBlock(FilterBlock):
+    def __init__(self, config, low_freq=5, high_freq=10, order=5, sos=False, name="Filtr dolprzepustowy"):
         self._high_freq = high_freq
         self._low_freq = low_freq
-        self._order = order
+        super().__init__(config, order, sos, name)
+
+    low_freq = parameter("_low_freq")
+    high_freq = parameter("_high_freq")
+
+    @property
+    def name(self):
+        return "Filtr pasmoprzepustowy (%.2f - %.2f Hz)" % (self._low_freq, self._high_freq)
+
+    def _coefficients(self, output):
+        return butter_bandpass(self._low_freq, self._high_freq, self.sample_frequency, order=self._order,
+                               output=output)
+
+
+class LowPassFilterBlock(FilterBlock):
+    def __init__(self, config, high_freq=10, order=5, sos=False, name="Filtr dolnoprzepustowy"):
+        self._high_freq = high_freq
+        super().__init__(config, order, sos, name)
+
+    high_freq = parameter("_high_freq")
+
+    @property
+    def name(self):
+        return "Filtr dolnoprzepustowy (%.2f Hz)" % self._high_freq
+
+    def _coefficients(self, output):
+        return butter_lowpass(self._high_freq, self.sample_frequency, order=self._order, output=output)
+
+
+class DifferenceBlock(Block):
+    """
+    Subtracts signal connected to the "reference" input from the signal on the "input" input.
+    """
+    def __init__(self, config, name="Różnica sygnałów"):
         super().__init__(config, name)
-        self._name = "Filtr pasmoprzepustowy (%.2f - %.2f Hz)" % (self._low_freq, self._high_freq)
 
     def _process(self):
-        b, a = butter_bandpass(self._low_freq, self._high_freq, self._config.sample_frequency, order=self._order)
-        y = filtfilt(b, a, self.input.signal)
-        return Signal(y, self._config.sample_frequency)
+        return self._signal(self.get_input("input").signal - self.get_input("reference").signal)
 
 
-class NoiseGeneratorBlock(Block):
-    def __init__(self, config, high_freq, name="Generator szumu pasmowego"):
+class NoiseGeneratorBlock(RandomBlock):
+    def __init__(self, config, high_freq, seed=None, name="Generator szumu pasmowego"):
         self._high_freq = high_freq
-        super().__init__(config, name)
+        super().__init__(config, seed, name)
+
+    high_freq = parameter("_high_freq")
 
     def _process(self):
-        noise = np.random.normal(loc=0.0, scale=1, size=self._config.timeline.shape)
+        from scipy.signal import filtfilt
+        noise = self.noise_stream().normal(self._config.length).astype(self._config.dtype, copy=False)
+        b, a = self._design()
+        return self._signal(filtfilt(b, a, noise))
+
+    def _design(self):
         b, a = butter_lowpass(self._high_freq, self._config.sample_frequency, order=5)
-        y = filtfilt(b, a, noise)
-        return Signal(y, self._config.sample_frequency)
\ No newline at end of file
+        return b.astype(self._config.dtype), a.astype(self._config.dtype)
+
+    def reset(self):
+        self._stream = self.noise_stream()
+        self._zi = None
+
+    def _process_chunk(self, chunk):
+        noise = self._stream.normal(chunk.shape[-1])
+        noise = noise.astype(chunk.dtype, copy=False)
+        from scipy.signal import lfilter
+        b, a = self._design()
+        if self._zi is None:
+            self._zi = np.zeros(noise.shape[:-1] + (max(len(a), len(b)) - 1,), chunk.dtype)
+        y, self._zi = lfilter(b, a, noise, zi=self._zi)
+        return y
+
+
+class ResamplerBlock(Block):
+    """
+    Changes sample frequency of the input by up/down with a polyphase FIR filter, like resample_poly().
+    In batch mode the output is aligned with the input, in streaming mode it is delayed by the group delay
+    of the filter, (len(filter) - 1) / 2 samples at up times the input rate.
+    """
+    def __init__(self, config, up=1, down=1, name="Zmiana częstotliwości próbkowania"):
+        if up < 1 or down < 1:
+            raise ValueError("Współczynniki zmiany częstotliwości próbkowania muszą być dodatnie.")
+        divisor = math.gcd(up, down)
+        self._up = up // divisor
+        self._down = down // divisor
+        super().__init__(config, name)
+
+    up = parameter("_up")
+    down = parameter("_down")
+
+    @property
+    def sample_frequency(self):
+        return self.input_frequency * self._up / self._down
+
+    def output_length(self, length):
+        return -(-length * self._up // self._down)
+
+    def _filter(self):
+        return resample_fir(self._up, self._down)
+
+    def _process(self):
+        from scipy.signal import resample_poly
+        x = self.input.signal
+        if self._up == self._down:
+            return self._signal(x)
+        return self._signal(resample_poly(x, self._up, self._down, axis=-1, window=self._filter()))
+
+    def reset(self):
+        self._history = None
+        self._consumed = 0
+        self._produced = 0
+
+    def _stream_filter(self):
+        return self._filter()
+
+    def _polyphase(self):
+        # Row p holds taps applied to the input samples for outputs at phase p of the up-sampled signal
+        h = self._stream_filter() * self._up
+        taps = -(-len(h) // self._up)
+        h = np.concatenate((h, np.zeros(taps * self._up - len(h))))
+        dtype = self._config.complex_dtype if np.iscomplexobj(h) else self._config.dtype
+        return h.reshape(taps, self._up).T.astype(dtype)
+
+    def _process_chunk(self, chunk):
+        if self._history is None:
+            self._bank = self._polyphase()
+            self._history = np.zeros(chunk.shape[:-1] + (self._bank.shape[1] - 1,), chunk.dtype)
+        taps = self._bank.shape[1]
+        buffer = np.concatenate((self._history, chunk), axis=-1)
+        consumed = self._consumed + chunk.shape[-1]
+        # Output m needs input samples up to m * down // up, all of them seen so far are produced
+        produced = -(-consumed * self._up // self._down)
+        positions = np.arange(self._produced, produced) * self._down
+        # Indices of input samples in the buffer, which starts taps - 1 samples before the chunk
+        newest = positions // self._up - (self._consumed - (taps - 1))
+        window = buffer[..., newest[:, None] - np.arange(taps)]
+        y = self._apply_bank(window, positions)
+        self._history = buffer[..., buffer.shape[-1] - (taps - 1):]
+        self._consumed = consumed
+        self._produced = produced
+        return y
+
+    def _apply_bank(self, window, positions):
+        # Window of input samples (..., outputs, taps) times the filter phase of every output
+        return np.einsum('...mk,mk->...m', window, self._bank[positions % self._up])
+
+
+class DecimatorBlock(ResamplerBlock):
+    def __init__(self, config, factor, name=None):
+        super().__init__(config, 1, factor, name or "Decymacja %d:1" % factor)
+
+
+class InterpolatorBlock(ResamplerBlock):
+    def __init__(self, config, factor, name=None):
+        super().__init__(config, factor, 1, name or "Interpolacja 1:%d" % factor)
+
+
+class DownConverterBlock(ResamplerBlock):
+    """
+    Mixes the input down by frequency and decimates it by factor in one pass, giving the same output as
+    BasebandMixerBlock followed by DecimatorBlock. The mixer is moved into the taps of the decimation filter,
+    so nothing is computed at the input sample rate apart from the filter itself.
+    """
+    def __init__(self, config, frequency, factor, name=None):
+        self._frequency = frequency
+        super().__init__(config, 1, factor, name or "Przemiana do pasma podstawowego %d:1" % factor)
+
+    frequency = parameter("_frequency")
+
+    def _taps(self, centre):
+        # Decimation filter with the mixer moved into it, the carrier phase is referred to the tap at centre
+        h = self._filter()
+        positions = np.arange(len(h)) - centre
+        return h * np.exp(2j * np.pi * np.multiply.outer(self._frequency, positions) / self.input_frequency)
+
+    def _carrier(self):
+        # Carrier at the output samples, every down-th input sample
+        return NCO(self._frequency, self.sample_frequency)
+
+    def _mix(self, y, carrier):
+        return np.multiply(y, carrier.phasor(y.shape[-1], out=np.empty(y.shape, y.dtype), conjugate=True), out=y)
+
+    def _process(self):
+        from scipy.signal import resample_poly
+        x = self.input.signal
+        # Taps of resample_poly() are centred, the carrier phase is referred to the centre tap
+        taps = self._taps((len(self._filter()) - 1) // 2)
+        y = resample_poly(x, 1, self._down, axis=-1, window=taps.real)
+        y = y + 1j * resample_poly(x, 1, self._down, axis=-1, window=taps.imag)
+        return self._signal(self._mix(y, self._carrier()))
+
+    def reset(self):
+        super().reset()
+        self._nco = self._carrier()
+
+    def _stream_filter(self):
+        return self._taps(0)
+
+    def _process_chunk(self, chunk):
+        return self._mix(super()._process_chunk(chunk), self._nco)
+
+
+class ChannelizerBlock(DownConverterBlock):
+    """
+    Splits a frequency-division multiplex back into channels: every carrier in frequencies is mixed down
+    to baseband and decimated by factor, giving complex output with the channel axis before the samples.
+    Same output as one DownConverterBlock per carrier, but the filters of all channels form a single bank
+    applied by one matrix product to the input windows of all outputs, in batch and in streaming mode.
+    """
+    def __init__(self, config, frequencies, factor, name=None):
+        super().__init__(config, np.atleast_1d(frequencies).tolist(), factor,
+                         name or "Rozdzielacz kanałów %d:1" % factor)
+
+    @property
+    def channels(self):
+        return len(self._frequency)
+
+    def _process(self):
+        x = self.input.signal
+        taps = len(self._filter())
+        # Same as streaming, but the newest input sample of output m is m * down + centre, like in resample_poly()
+        centre = (taps - 1) // 2
+        bank = self._taps(centre).astype(self._config.complex_dtype)
+        padded = np.pad(x, [(0, 0)] * (x.ndim - 1) + [(taps - 1, centre + 1)])
+        outputs = self.output_length(x.shape[-1])
+        y = np.empty(x.shape[:-1] + (self.channels, outputs), self._config.complex_dtype)
+        # Windows of input samples take taps times more memory than the input, they are built in segments
+        for start in range(0, outputs, CHANNELIZER_SEGMENT):
+            positions = np.arange(start, min(start + CHANNELIZER_SEGMENT, outputs)) * self._down + centre + taps - 1
+            window = padded[..., positions[:, None] - np.arange(taps)]
+            y[..., start:start + len(positions)] = np.swapaxes(np.matmul(window, bank.T), -1, -2)
+        return self._signal(self._mix(y, self._carrier()))
+
+    def _polyphase(self):
+        return self._taps(0).astype(self._config.complex_dtype)
+
+    def _apply_bank(self, window, positions):
+        # Filters of all channels at once, (..., outputs, taps) @ (taps, channels)
+        return np.swapaxes(np.matmul(window, self._bank.T), -1, -2)
+
+
+class BasebandMixerBlock(Block):
+    """
+    Mixes the input down by frequency, giving complex signal with the carrier at 0 Hz. Image at twice
+    the carrier frequency has to be removed by a following low-pass filter or decimator.
+    """
+    def __init__(self, config, frequency, name="Mieszacz do pasma podstawowego"):
+        self._frequency = frequency
+        super().__init__(config, name)
+
+    frequency = parameter("_frequency")
+
+    def _carrier(self):
+        return NCO(self._frequency, self.sample_frequency)
+
+    def _mix(self, x, carrier):
+        y = carrier.phasor(x.shape[-1], out=np.empty(x.shape, self._config.complex_dtype), conjugate=True)
+        return np.multiply(y, x, out=y)
+
+    def _process(self):
+        return self._signal(self._mix(self.input.signal, self._carrier()))
+
+    def reset(self):
+        self._nco = self._carrier()
+
+    def _process_chunk(self, chunk):
+        return self._mix(chunk, self._nco)
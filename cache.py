@@ -0,0 +1,106 @@
+import glob
+import json
+import os
+import uuid
+
+import numpy as np
+
+from signals import Signal
+
+__author__ = 'Wojciech Urbański'
+
+
+class ResultCache():
+    """
+    Persistent cache of block outputs addressed by Block.cache_key(). Every output is kept in its own .npy file,
+    loaded back memory-mapped. A manifest listing the output names is written after all of them, so an entry
+    exists only once it is complete. When the cache grows over max_bytes, least recently used entries
+    are removed. Several processes may share one directory.
+    """
+    def __init__(self, directory, max_bytes=2 ** 30):
+        self._directory = directory
+        self._max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key, name):
+        return os.path.join(self._directory, "%s.%s.npy" % (key, name))
+
+    def _manifest(self, key):
+        return os.path.join(self._directory, "%s.json" % key)
+
+    def _replace(self, path, write):
+        # Written under a temporary name and renamed, readers never see a partial file
+        root, extension = os.path.splitext(path)
+        temporary = "%s.tmp.%s%s" % (root, uuid.uuid4().hex, extension)
+        write(temporary)
+        os.replace(temporary, path)
+
+    def get(self, key, sample_frequency):
+        """
+        Outputs stored under key as a dictionary of memory-mapped signals, None if they are not cached.
+        """
+        outputs = {}
+        try:
+            with open(self._manifest(key)) as f:
+                names = json.load(f)
+            for name in names:
+                path = self._path(key, name)
+                outputs[name] = Signal.load(path, sample_frequency)
+                # Modification time marks the last use of the entry
+                os.utime(path)
+        except (OSError, ValueError):
+            # Not cached, evicted or still being written by another process
+            self.misses += 1
+            return None
+        self.hits += 1
+        return outputs
+
+    def put(self, key, outputs):
+        """
+        Stores outputs under key, returns them reloaded from the cache.
+        """
+        cached = {}
+        for name, signal in outputs.items():
+            path = self._path(key, name)
+            self._replace(path, lambda temporary: np.save(temporary, signal.signal))
+            cached[name] = Signal.load(path, signal.sample_frequency)
+
+        def write_manifest(temporary):
+            with open(temporary, "w") as f:
+                json.dump(sorted(outputs), f)
+
+        self._replace(self._manifest(key), write_manifest)
+        self._evict()
+        return cached
+
+    def _evict(self):
+        entries = []
+        for path in glob.glob(os.path.join(self._directory, "*.npy")):
+            if ".tmp." in path:
+                continue
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self._max_bytes:
+                break
+            # Manifest goes first, readers never find an entry with some of its outputs missing
+            for stale in (self._manifest(os.path.basename(path).split(".")[0]), path):
+                try:
+                    os.remove(stale)
+                except OSError:
+                    pass
+            total -= size
+
+    def size(self):
+        return sum(os.path.getsize(path) for path in glob.glob(os.path.join(self._directory, "*.npy")))
+
+    def clear(self):
+        for path in glob.glob(os.path.join(self._directory, "*.json")) + \
+                glob.glob(os.path.join(self._directory, "*.npy")):
+            os.remove(path)
@@ -1,22 +1,114 @@
 import os
-from scipy.signal import butter, lfilter
+from functools import lru_cache
+import numpy as np
 
 __author__ = 'Wojciech Urbański'
 
+# SciPy is imported inside the functions, importing scipy.signal alone takes about a second
 
-def butter_lowpass(cutoff, fs, order=5, analog=False):
-    nyq = 0.5 * fs
-    normal_cutoff = cutoff / nyq
-    b, a = butter(order, normal_cutoff, btype='low', analog=analog)
-    return b, a
+# Maximum number of filter designs kept in memory, least recently used ones are dropped first
+DESIGN_CACHE_SIZE = 256
 
 
-def butter_bandpass(lowcut, highcut, fs, order=5, analog=False):
+@lru_cache(maxsize=DESIGN_CACHE_SIZE)
+def _butter_design(btype, cutoffs, fs, order, analog, output):
+    from scipy.signal import butter
     nyq = 0.5 * fs
-    low = lowcut / nyq
-    high = highcut / nyq
-    b, a = butter(order, [low, high], btype='band', analog=analog)
-    return b, a
+    normal_cutoffs = [cutoff / nyq for cutoff in cutoffs]
+    if len(normal_cutoffs) == 1:
+        normal_cutoffs = normal_cutoffs[0]
+    return butter(order, normal_cutoffs, btype=btype, analog=analog, output=output)
+
+
+def _copy_design(design):
+    # Cached arrays are shared, callers get their own copies to modify
+    if isinstance(design, tuple):
+        return tuple(coefficients.copy() for coefficients in design)
+    return design.copy()
+
+
+def design_cache_info():
+    return _butter_design.cache_info()
+
+
+def clear_design_cache():
+    _butter_design.cache_clear()
+    _resample_design.cache_clear()
+
+
+def butter_lowpass(cutoff, fs, order=5, analog=False, output='ba'):
+    """
+    Designs Butterworth low-pass filter, returns (b, a) or second-order sections when output='sos'.
+    Designs are memoised, repeated calls with the same parameters are cheap.
+    """
+    return _copy_design(_butter_design('low', (float(cutoff),), float(fs), int(order), analog, output))
+
+
+def butter_bandpass(lowcut, highcut, fs, order=5, analog=False, output='ba'):
+    """
+    Designs Butterworth band-pass filter, returns (b, a) or second-order sections when output='sos'.
+    Designs are memoised, repeated calls with the same parameters are cheap.
+    """
+    return _copy_design(_butter_design('band', (float(lowcut), float(highcut)), float(fs), int(order), analog,
+                                       output))
+
+
+def hilbert_fir(numtaps=513, window='blackman'):
+    """
+    Windowed FIR approximation of the Hilbert transformer, delays the signal by (numtaps - 1) / 2 samples.
+    """
+    if numtaps % 2 == 0:
+        raise ValueError("Liczba współczynników filtru musi być nieparzysta.")
+    from scipy.signal import get_window
+    n = np.arange(numtaps) - (numtaps - 1) // 2
+    h = np.zeros(numtaps)
+    odd = n % 2 != 0
+    h[odd] = 2 / (np.pi * n[odd])
+    return h * get_window(window, numtaps)
+
+
+@lru_cache(maxsize=DESIGN_CACHE_SIZE)
+def _resample_design(up, down, half_length, beta):
+    from scipy.signal import firwin
+    max_rate = max(up, down)
+    return firwin(2 * half_length * max_rate + 1, 1.0 / max_rate, window=('kaiser', beta))
+
+
+def resample_fir(up, down, half_length=10, beta=5.0):
+    """
+    Low-pass FIR of a polyphase resampler by up/down, the same as designed by scipy.signal.resample_poly():
+    cut-off at the lower of both Nyquist frequencies and Kaiser window. Gain of up is not included.
+    Designs are memoised like the Butterworth ones.
+    """
+    return _copy_design(_resample_design(int(up), int(down), int(half_length), float(beta)))
+
+
+def analytic_signal(x, remove_dc=False):
+    """
+    Analytic signal x + jH{x} along the last axis, computed with a single forward and inverse FFT
+    zero-padded to a fast length. With remove_dc the mean is removed from the real part.
+    """
+    from scipy import fft
+    length = x.shape[-1]
+    n = fft.next_fast_len(length, real=True)
+    spectrum = fft.rfft(x, n=n, axis=-1)
+    # Doubling positive frequencies, the negative ones are left out as zeros of the inverse FFT
+    weights = np.full(spectrum.shape[-1], 2.0)
+    weights[0] = 0 if remove_dc else 1
+    if n % 2 == 0:
+        weights[-1] = 1
+    spectrum *= weights
+    return fft.ifft(spectrum, n=n, axis=-1)[..., :length]
+
+
+def fir_analytic_signal(x, numtaps=513):
+    """
+    Analytic signal along the last axis using the FIR Hilbert transformer with overlap-add convolution,
+    cost grows linearly with the length of x. Edges of the signal are only approximate.
+    """
+    from scipy.signal import oaconvolve
+    h = hilbert_fir(numtaps).astype(x.dtype).reshape((1,) * (x.ndim - 1) + (-1,))
+    return x + 1j * oaconvolve(x, h, mode='same', axes=-1)
 
 
 def plot_filter(b, a, threshold, lines):
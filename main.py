@@ -1,4 +1,10 @@
+import argparse
+import itertools
+import json
+import os
 import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
 from cli import menu, rename
 from system import *
@@ -19,10 +25,81 @@ def quit_app():
     raise SystemExit
 
 
-def main():
-    options = [quit_app, create_system]
-    menu("Main Menu", options)()
+def run_scenario(task):
+    """
+    Simulates a single scenario, returns its metrics: mean MSE, achieved SNR of the first AWGN channel
+    (None without one) and timing. Errors are reported in the result instead of being raised.
+    """
+    import numpy as np
+    from scenario import build_system, mse
+    from blocks import AWGNChannelBlock
+    index, path, description, cache_dir = task
+    start = time.perf_counter()
+    cpu_start = time.process_time()
+    result = {"index": index, "file": path, "scenario": description.get("name")}
+    try:
+        system = build_system(description, cache_dir)
+        system.execute(jobs=1)
+        channels = [block for block in system.blocks if isinstance(block, AWGNChannelBlock)]
+        result.update(mse=float(np.mean(mse(system))),
+                      snr_achieved=float(np.mean(channels[0].get_snr())) if channels else None)
+    except Exception as error:
+        result.update(error="%s: %s" % (type(error).__name__, error))
+    result.update(wall_time=time.perf_counter() - start, cpu_time=time.process_time() - cpu_start,
+                  worker=os.getpid())
+    return result
+
+
+def run_scenarios(tasks, jobs=None):
+    """
+    Generates results of run_scenario() for every task as soon as they are ready, on jobs processes.
+    """
+    if jobs == 1:
+        yield from map(run_scenario, tasks)
+        return
+    with ProcessPoolExecutor(max_workers=jobs or os.cpu_count()) as executor:
+        for future in as_completed([executor.submit(run_scenario, task) for task in tasks]):
+            yield future.result()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Symulacja systemu modulacji fazowej. Bez plików scenariuszy "
+                                                 "uruchamia menu interaktywne.")
+    parser.add_argument("scenarios", nargs="*", help="pliki scenariuszy YAML lub JSON")
+    parser.add_argument("-j", "--jobs", type=int, default=None, help="liczba procesów (domyślnie liczba CPU)")
+    parser.add_argument("-o", "--output", help="plik z wynikami w formacie JSON lines (domyślnie stdout)")
+    parser.add_argument("--cache-dir", help="katalog pamięci podręcznej wyników bloków")
+    args = parser.parse_args(argv)
+
+    if not args.scenarios:
+        options = [quit_app, create_system]
+        menu("Main Menu", options)()
+        return 0
+
+    from scenario import load_scenarios
+    scenarios = []
+    # Files which cannot be read are reported like failed scenarios, the remaining ones still run
+    errors = []
+    for path in args.scenarios:
+        try:
+            scenarios.extend((path, description) for description in load_scenarios(path))
+        except Exception as error:
+            errors.append({"index": None, "file": path, "scenario": None,
+                           "error": "%s: %s" % (type(error).__name__, error)})
+    tasks = [(index, path, description, args.cache_dir) for index, (path, description) in enumerate(scenarios)]
+    failed = False
+    output = open(args.output, "w") if args.output else sys.stdout
+    try:
+        for result in itertools.chain(errors, run_scenarios(tasks, args.jobs)):
+            failed = failed or "error" in result
+            # One line per scenario, flushed so the results can be followed while the batch runs
+            output.write(json.dumps(result) + "\n")
+            output.flush()
+    finally:
+        if output is not sys.stdout:
+            output.close()
+    return 1 if failed else 0
 
 
 if __name__ == '__main__':
-    sys.exit(main())
\ No newline at end of file
+    sys.exit(main())
@@ -0,0 +1,141 @@
+import numpy as np
+
+__author__ = 'Wojciech Urbański'
+
+# Samples processed at once by update(), temporary arrays never exceed this length
+SEGMENT_SIZE = 2 ** 16
+
+
+class Accumulator():
+    """
+    Base of single-pass metric accumulators. update() takes signals with samples on the last axis and keeps
+    separate statistics for every index of the leading axes (trials, channels), so a long signal may be
+    passed whole or chunk by chunk. merge() adds statistics collected elsewhere, by another worker or on
+    another part of the timeline, pooled() combines all trials. Only a few numbers per trial are kept,
+    accumulators are cheap to send between processes.
+    """
+    def update(self, *signals):
+        signals = np.broadcast_arrays(*signals)
+        for start in range(0, signals[0].shape[-1], SEGMENT_SIZE):
+            self._update(*(signal[..., start:start + SEGMENT_SIZE] for signal in signals))
+        return self
+
+    def _update(self, *signals):
+        raise NotImplementedError()
+
+    def merge(self, other):
+        if type(other) is not type(self):
+            raise TypeError("Nie można połączyć statystyk %s z %s." % (type(self).__name__, type(other).__name__))
+        self._merge(other)
+        return self
+
+    def _merge(self, other):
+        raise NotImplementedError()
+
+    def pooled(self):
+        """
+        Statistics of all trials taken together.
+        """
+        raise NotImplementedError()
+
+
+class RunningVariance(Accumulator):
+    """
+    Mean and variance (Welford, combined for whole chunks as in Chan et al.).
+    """
+    def __init__(self, count=0, mean=0.0, m2=0.0):
+        self.count = count
+        self.mean = mean
+        self.m2 = m2
+
+    def _update(self, signal):
+        count = signal.shape[-1]
+        if count:
+            self._combine(count, np.mean(signal, axis=-1), np.var(signal, axis=-1) * count)
+
+    def _combine(self, count, mean, m2):
+        total = self.count + count
+        delta = mean - self.mean
+        self.m2 = self.m2 + m2 + np.abs(delta) ** 2 * self.count * count / total
+        self.mean = self.mean + delta * count / total
+        self.count = total
+
+    def _merge(self, other):
+        if other.count:
+            self._combine(other.count, other.mean, other.m2)
+
+    @property
+    def variance(self):
+        return self.m2 / self.count
+
+    @property
+    def power(self):
+        """
+        Mean squared value, variance with the mean included.
+        """
+        return self.variance + np.abs(self.mean) ** 2
+
+    def pooled(self):
+        counts = np.broadcast_to(self.count, np.shape(self.mean))
+        total = np.sum(counts)
+        mean = np.sum(counts * self.mean) / total
+        m2 = np.sum(np.broadcast_to(self.m2, counts.shape)) + np.sum(counts * np.abs(self.mean - mean) ** 2)
+        return RunningVariance(total, mean, m2)
+
+
+class ErrorStatistics(Accumulator):
+    """
+    Error of output signals against a reference: MSE, peak error, error vector magnitude and SNR.
+    For a channel, reference is its input and output the noisy signal, the error is then the noise.
+    """
+    def __init__(self):
+        self.reference = RunningVariance()
+        self.error_power = 0.0
+        self.peak = 0.0
+
+    @property
+    def count(self):
+        return self.reference.count
+
+    def _update(self, reference, output):
+        if reference.shape[-1] == 0:
+            return
+        error = np.abs(output - reference)
+        self.peak = np.maximum(self.peak, np.max(error, axis=-1))
+        np.square(error, out=error)
+        self.error_power = self.error_power + np.sum(error, axis=-1)
+        self.reference.update(reference)
+
+    def _merge(self, other):
+        self.reference.merge(other.reference)
+        self.error_power = self.error_power + other.error_power
+        self.peak = np.maximum(self.peak, other.peak)
+
+    @property
+    def mse(self):
+        return self.error_power / self.count
+
+    @property
+    def rmse(self):
+        return np.sqrt(self.mse)
+
+    @property
+    def evm(self):
+        """
+        RMS error relative to RMS of the reference, in percent.
+        """
+        return 100 * np.sqrt(self.mse / self.reference.power)
+
+    @property
+    def snr(self):
+        """
+        Variance of the reference over the mean error power, in dB.
+        """
+        return 10 * np.log10(self.reference.variance / self.mse)
+
+    def pooled(self):
+        statistics = ErrorStatistics()
+        statistics.reference = self.reference.pooled()
+        statistics.error_power = np.sum(self.error_power)
+        statistics.peak = np.max(self.peak)
+        return statistics
@@ -0,0 +1,63 @@
+import numpy as np
+
+__author__ = 'Wojciech Urbański'
+
+BIT_GENERATORS = {"PCG64": np.random.PCG64, "PCG64DXSM": np.random.PCG64DXSM, "Philox": np.random.Philox,
+                  "SFC64": np.random.SFC64, "MT19937": np.random.MT19937}
+# Number of samples drawn from one child stream, fixed so the noise does not depend on the chunk size
+STREAM_BLOCK_SIZE = 2 ** 16
+
+
+class NoiseStream():
+    """
+    Gaussian noise of a single block. Every trial and every STREAM_BLOCK_SIZE samples of the timeline have
+    their own child stream of seed_sequence, so a trial gets the same noise when simulated in one piece,
+    in chunks of any size or in another process.
+    """
+    def __init__(self, seed_sequence, trials=None, bit_generator="PCG64", block_size=STREAM_BLOCK_SIZE):
+        if bit_generator not in BIT_GENERATORS:
+            raise ValueError("Nieobsługiwany generator liczb losowych: %s" % bit_generator)
+        self._seed_sequence = seed_sequence
+        self._trials = trials
+        self._bit_generator = BIT_GENERATORS[bit_generator]
+        self._block_size = block_size
+        self.seek(0)
+
+    def _generator(self, trial, index):
+        seed_sequence = np.random.SeedSequence(self._seed_sequence.entropy,
+                                               spawn_key=self._seed_sequence.spawn_key + (trial, index))
+        return np.random.Generator(self._bit_generator(seed_sequence))
+
+    def seek(self, position):
+        """
+        Moves to the given sample of the timeline.
+        """
+        self._position = position
+        self._index = None
+        self._generators = None
+
+    @property
+    def position(self):
+        return self._position
+
+    def normal(self, length):
+        """
+        Next length samples of standard normal noise, shape (length,) or (trials, length).
+        """
+        rows = 1 if self._trials is None else self._trials
+        noise = np.empty((rows, length))
+        done = 0
+        while done < length:
+            index, offset = divmod(self._position, self._block_size)
+            if index != self._index:
+                self._index = index
+                self._generators = [self._generator(trial, index) for trial in range(rows)]
+                # Only after seek(), sequential reads always start a child stream at its beginning
+                for generator in self._generators:
+                    generator.standard_normal(offset)
+            count = min(length - done, self._block_size - offset)
+            for trial, generator in enumerate(self._generators):
+                generator.standard_normal(out=noise[trial, done:done + count])
+            done += count
+            self._position += count
+        return noise[0] if self._trials is None else noise
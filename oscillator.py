@@ -0,0 +1,142 @@
+import numpy as np
+
+__author__ = 'Wojciech Urbański'
+
+# Samples computed at once, work buffers of this size are allocated once per oscillator
+BLOCK_SIZE = 2 ** 14
+# Phase is kept as a 64-bit word, a full turn is 2**64
+_WORD = 2 ** 64
+_RADIANS = 2 * np.pi / _WORD
+
+
+class NCO():
+    """
+    Numerically controlled oscillator. Phase is accumulated in a 64-bit integer word wrapping at a full turn,
+    so it is exact after any number of samples and continuous between calls, however the signal is split
+    into chunks. Samples are computed in blocks with preallocated buffers and written into out arrays.
+    With lut_bits set, sin() reads a table of 2**lut_bits values instead of evaluating np.sin().
+    An array of frequencies gives a bank of oscillators, their samples have shape (channels, length).
+    """
+    def __init__(self, frequency, sample_frequency, phase=0.0, lut_bits=None):
+        self._sample_frequency = sample_frequency
+        self.frequency = frequency
+        self._start = phase
+        channels = len(self._step)
+        self._index = np.arange(BLOCK_SIZE, dtype=np.uint64)
+        self._words = np.empty((channels, BLOCK_SIZE), dtype=np.uint64)
+        self._buffer = np.empty((channels, BLOCK_SIZE))
+        self._lut_bits = lut_bits
+        if lut_bits is not None:
+            self._table = np.sin(np.arange(2 ** lut_bits) * (2 * np.pi / 2 ** lut_bits))
+        self.reset()
+
+    @property
+    def frequency(self):
+        return self._frequency
+
+    @frequency.setter
+    def frequency(self, frequency):
+        self._frequency = frequency
+        self._shape = np.shape(frequency)
+        # Phase increment per sample, negative frequencies wrap around like the accumulator itself
+        self._step = self._words_of(np.atleast_1d(frequency) / self._sample_frequency)
+
+    @staticmethod
+    def _words_of(turns):
+        # Python integers keep all 64 bits, float64 would round them
+        return np.array([int(round(value * _WORD)) % _WORD for value in turns], dtype=np.uint64)
+
+    def reset(self, phase=None):
+        """
+        Starts again from phase (the initial phase by default) at the next sample.
+        """
+        if phase is not None:
+            self._start = phase
+        start = np.broadcast_to(self._start, self._step.shape) / (2 * np.pi)
+        self._word = self._words_of(start)
+
+    def advance(self, length):
+        """
+        Skips length samples.
+        """
+        # Unsigned arrays wrap modulo 2**64 like the accumulator
+        self._word = self._word + self._step * np.uint64(length % _WORD)
+
+    @property
+    def current_phase(self):
+        phase = self._word * _RADIANS
+        return phase.reshape(self._shape)
+
+    def _blocks(self, length):
+        # Phase words of the next length samples, one block at a time: (start, stop, words)
+        for start in range(0, length, BLOCK_SIZE):
+            count = min(BLOCK_SIZE, length - start)
+            words = self._words[:, :count]
+            np.multiply(self._index[:count], self._step[:, None], out=words)
+            np.add(words, self._word[:, None], out=words)
+            self.advance(count)
+            yield start, start + count, words.reshape(self._shape + (count,))
+
+    def _output(self, length, out, dtype=np.float64):
+        if out is None:
+            return np.empty(self._shape + (length,), dtype)
+        if out.shape[-1] != length:
+            raise ValueError("Długość bufora wyjściowego (%d) jest inna niż liczba próbek (%d)."
+                             % (out.shape[-1], length))
+        return out
+
+    def phase(self, length, out=None):
+        """
+        Phase of the next length samples in [0, 2*pi).
+        """
+        out = self._output(length, out)
+        for start, stop, words in self._blocks(length):
+            np.multiply(words, _RADIANS, out=out[..., start:stop])
+        return out
+
+    def add_phase(self, out, sign=1):
+        """
+        Adds (sign=1) or subtracts (sign=-1) phase of the next out.shape[-1] samples to out, in place.
+        """
+        for start, stop, words in self._blocks(out.shape[-1]):
+            buffer = self._buffer[:, :stop - start].reshape(words.shape)
+            np.multiply(words, sign * _RADIANS, out=buffer)
+            np.add(out[..., start:stop], buffer, out=out[..., start:stop])
+        return out
+
+    def sin(self, length, out=None):
+        """
+        Sine of the phase of the next length samples.
+        """
+        out = self._output(length, out)
+        if self._lut_bits is None:
+            self.phase(length, out)
+            return np.sin(out, out=out)
+        for start, stop, words in self._blocks(length):
+            # Upper bits of the phase word address the table
+            np.right_shift(words, np.uint64(64 - self._lut_bits), out=words)
+            np.take(self._table, words.view(np.int64), out=out[..., start:stop])
+        return out
+
+    def phasor(self, length, out=None, conjugate=False):
+        """
+        exp(1j * phase) of the next length samples, exp(-1j * phase) if conjugate.
+        """
+        out = self._output(length, out, np.complex128)
+        for start, stop, words in self._blocks(length):
+            buffer = self._buffer[:, :stop - start].reshape(words.shape)
+            np.multiply(words, _RADIANS, out=buffer)
+            np.cos(buffer, out=out.real[..., start:stop])
+            np.sin(buffer, out=out.imag[..., start:stop])
+        if conjugate:
+            np.negative(out.imag, out=out.imag)
+        return out
+
+
+def wrap_phase(phase):
+    """
+    Wraps phase into [-pi, pi), in place.
+    """
+    np.add(phase, np.pi, out=phase)
+    np.remainder(phase, 2 * np.pi, out=phase)
+    return np.subtract(phase, np.pi, out=phase)
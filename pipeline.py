@@ -0,0 +1,178 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from streamio import SourceBlock, SinkBlock, StreamStats
+
+__author__ = 'Wojciech Urbański'
+
+# Chunks waiting between two stages, a full queue stops the stage before it
+QUEUE_SIZE = 4
+
+
+class PipelineStats(StreamStats):
+    """
+    StreamStats of an AsyncPipeline run, with depths of the queues between stages sampled whenever
+    a chunk is put into them.
+    """
+    def __init__(self):
+        super().__init__()
+        self.queues = {}
+
+    def record_depth(self, name, depth, capacity):
+        queue = self.queues.setdefault(name, {"capacity": capacity, "samples": 0, "total": 0, "max_depth": 0})
+        queue["samples"] += 1
+        queue["total"] += depth
+        queue["max_depth"] = max(queue["max_depth"], depth)
+
+    def summary(self):
+        summary = super().summary()
+        latencies = np.array(self.latencies) if self.latencies else np.zeros(1)
+        summary["latency_p90"] = float(np.percentile(latencies, 90))
+        summary["queues"] = {name: {"capacity": queue["capacity"], "max_depth": queue["max_depth"],
+                                    "mean_depth": queue["total"] / queue["samples"]}
+                             for name, queue in self.queues.items()}
+        return summary
+
+    def print_summary(self):
+        super().print_summary()
+        for name, queue in self.summary()["queues"].items():
+            print("Kolejka do %s: pojemność %d, średnio %.2f, maksymalnie %d"
+                  % (name, queue["capacity"], queue["mean_depth"], queue["max_depth"]))
+
+
+class AsyncPipeline():
+    """
+    Runs the block chain of config in streaming mode with every block as a separate asyncio task.
+    Tasks are connected by queues of at most queue_size chunks and process_chunk() calls run on a thread
+    pool, so stages overlap: the filter works on chunk k while the demodulator handles chunk k-1.
+    Every block still gets its chunks one at a time and in order, so its streaming state stays valid.
+    Like run_stream(), the run ends when a source block reaches the end of its stream or after duration
+    seconds of signal.
+    """
+    def __init__(self, config, chunk_size=4096, queue_size=QUEUE_SIZE, duration=None, executor=None):
+        if chunk_size < 1:
+            raise ValueError("Rozmiar bloku próbek musi być większy niż 0.")
+        if duration is None and not any(isinstance(block, SourceBlock) for block in config.blocks):
+            raise ValueError("Strumień bez bloku źródłowego wymaga podania czasu trwania.")
+        self._config = config
+        self._chunk_size = chunk_size
+        self._queue_size = queue_size
+        self._limit = None if duration is None else int(np.ceil(duration * config.sample_frequency))
+        self._executor = executor
+        self.stats = None
+
+    async def _feed(self, queue, name, stop):
+        # Empty input chunks for the first block, every chunk remembers when it entered the pipeline
+        start = 0
+        while not stop.is_set() and (self._limit is None or start < self._limit):
+            count = self._chunk_size if self._limit is None else min(self._chunk_size, self._limit - start)
+            await self._put(queue, name, (np.zeros(count, self._config.dtype), time.perf_counter()))
+            start += count
+        await queue.put(None)
+
+    async def _put(self, queue, name, item):
+        await queue.put(item)
+        self.stats.record_depth(name, queue.qsize(), queue.maxsize)
+
+    async def _stage(self, block, executor, inputs, outputs, name, stop):
+        loop = asyncio.get_running_loop()
+        source = isinstance(block, SourceBlock)
+        ended = False
+
+        def process(chunk):
+            # Arrival of the oldest sample has to be read in the same call, before the next chunk
+            result = block.process_chunk(chunk)
+            return result, block.arrival if source else None
+
+        try:
+            while True:
+                item = await inputs.get()
+                if item is None:
+                    break
+                if ended:
+                    # Chunks already requested from a source which reached the end of its stream
+                    continue
+                chunk, origin = item
+                result, arrival = await loop.run_in_executor(executor, process, chunk)
+                if source and result.shape[-1] < chunk.shape[-1]:
+                    ended = True
+                    stop.set()
+                if result.shape[-1] > 0:
+                    await self._put(outputs, name, (result, origin if arrival is None else min(origin, arrival)))
+        except Exception as error:
+            # Stages before stop feeding, stream() raises the first error once the chain has drained
+            self._errors.append(error)
+            stop.set()
+            await self._drain(inputs)
+        finally:
+            # Without the end marker the following stages and stream() would wait forever
+            await outputs.put(None)
+
+    async def _drain(self, queue):
+        # Takes the chunks still coming from the previous stage, so it is never blocked on a full queue
+        while await queue.get() is not None:
+            pass
+
+    async def stream(self):
+        """
+        Asynchronous generator of timeline chunks and output chunks of the last block.
+        """
+        blocks = self._config.blocks
+        for block in blocks:
+            block.reset()
+        self.stats = PipelineStats()
+        self._errors = []
+        # Queue i feeds block i, the last one collects output of the chain
+        queues = [asyncio.Queue(self._queue_size) for _ in range(len(blocks) + 1)]
+        names = [block.name for block in blocks] + ["wyjście"]
+        results = queues[-1]
+        stop = asyncio.Event()
+        executor = self._executor or ThreadPoolExecutor(max_workers=len(blocks))
+        tasks = [asyncio.ensure_future(self._feed(queues[0], names[0], stop))]
+        tasks += [asyncio.ensure_future(self._stage(block, executor, queues[i], queues[i + 1], names[i + 1], stop))
+                  for i, block in enumerate(blocks)]
+        position = 0
+        try:
+            while True:
+                item = await results.get()
+                if item is None:
+                    break
+                chunk, origin = item
+                self.stats.record(chunk.shape[-1], origin)
+                timeline = np.arange(position, position + chunk.shape[-1]) / self._config.sample_frequency
+                position += chunk.shape[-1]
+                yield timeline.astype(self._config.dtype, copy=False), chunk
+            await asyncio.gather(*tasks)
+            if self._errors:
+                raise self._errors[0]
+        finally:
+            for task in tasks:
+                task.cancel()
+            for block in blocks:
+                block.close()
+            self.stats.buffers = {block.name: block.buffer_stats for block in blocks
+                                  if isinstance(block, (SourceBlock, SinkBlock))}
+            if self._executor is None:
+                executor.shutdown(wait=False)
+
+    async def run(self):
+        """
+        Runs the pipeline discarding outputs of the last block, e.g. when it ends with a sink.
+
+        :rtype : PipelineStats
+        """
+        async for _ in self.stream():
+            pass
+        return self.stats
+
+
+def run_pipeline(config, chunk_size=4096, queue_size=QUEUE_SIZE, duration=None):
+    """
+    Runs AsyncPipeline of config in a new event loop, returns its statistics.
+
+    :rtype : PipelineStats
+    """
+    return asyncio.run(AsyncPipeline(config, chunk_size, queue_size, duration).run())
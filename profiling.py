@@ -0,0 +1,97 @@
+import cProfile
+import json
+import os
+import pstats
+import threading
+import time
+import tracemalloc
+
+__author__ = 'Wojciech Urbański'
+
+
+def _nbytes(array):
+    return 0 if array is None else array.nbytes
+
+
+class Profiler():
+    """
+    Hook for SystemConfiguration recording every block invocation: wall and CPU time, input and output sizes
+    and, with trace_memory, bytes allocated during the call. With cprofile the calls are also profiled
+    by cProfile (main thread only). Usage: config.add_hook(Profiler()).
+    """
+    def __init__(self, cprofile=False, trace_memory=False):
+        self.records = []
+        self._profile = cProfile.Profile() if cprofile else None
+        self._trace_memory = trace_memory
+        # Blocks may run concurrently on several threads, each of them has its own stack of open calls
+        self._local = threading.local()
+        self._origin = time.perf_counter()
+        if trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def pre_process(self, block, mode, data):
+        memory = None
+        if self._trace_memory:
+            tracemalloc.reset_peak()
+            memory = tracemalloc.get_traced_memory()[0]
+        if self._profile is not None and threading.current_thread() is threading.main_thread():
+            self._profile.enable()
+        if not hasattr(self._local, "stack"):
+            self._local.stack = []
+        self._local.stack.append((time.perf_counter(), time.process_time(), memory))
+
+    def post_process(self, block, mode, data, result):
+        wall_end, cpu_end = time.perf_counter(), time.process_time()
+        if self._profile is not None and threading.current_thread() is threading.main_thread():
+            self._profile.disable()
+        wall_start, cpu_start, memory = self._local.stack.pop()
+        self.records.append({"block": block.name, "type": type(block).__name__, "mode": mode,
+                             "start": wall_start - self._origin, "wall_time": wall_end - wall_start,
+                             "cpu_time": cpu_end - cpu_start,
+                             "allocated": tracemalloc.get_traced_memory()[1] - memory if memory is not None else None,
+                             "input_bytes": _nbytes(data), "output_bytes": _nbytes(result),
+                             "input_shape": None if data is None else list(data.shape),
+                             "output_shape": None if result is None else list(result.shape),
+                             "thread": threading.get_ident()})
+
+    def summary(self):
+        """
+        Total wall and CPU time and number of invocations per block.
+        """
+        totals = {}
+        for record in self.records:
+            total = totals.setdefault(record["block"], {"calls": 0, "wall_time": 0.0, "cpu_time": 0.0})
+            total["calls"] += 1
+            total["wall_time"] += record["wall_time"]
+            total["cpu_time"] += record["cpu_time"]
+        return totals
+
+    def print_summary(self):
+        print("%-45s %6s %10s %10s" % ("Blok", "Wywołań", "Czas [s]", "CPU [s]"))
+        for name, total in sorted(self.summary().items(), key=lambda item: -item[1]["wall_time"]):
+            print("%-45s %6d %10.4f %10.4f" % (name, total["calls"], total["wall_time"], total["cpu_time"]))
+
+    def stats(self):
+        """
+        cProfile statistics of all recorded invocations, requires cprofile=True.
+
+        :rtype : pstats.Stats
+        """
+        if self._profile is None:
+            raise ValueError("Profilowanie cProfile nie zostało włączone.")
+        return pstats.Stats(self._profile)
+
+    def chrome_trace(self):
+        """
+        Records as Chrome trace-event format, viewable in chrome://tracing or Perfetto.
+        """
+        events = [{"name": record["block"], "cat": record["mode"], "ph": "X", "pid": os.getpid(),
+                   "tid": record["thread"], "ts": record["start"] * 1e6, "dur": record["wall_time"] * 1e6,
+                   "args": {key: record[key] for key in ("type", "cpu_time", "allocated", "input_bytes",
+                                                         "output_bytes", "input_shape", "output_shape")}}
+                  for record in self.records]
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def save_trace(self, path):
+        with open(path, "w") as f:
+            json.dump(self.chrome_trace(), f)
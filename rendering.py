@@ -0,0 +1,151 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+__author__ = 'Wojciech Urbański'
+
+# Number of min/max pairs kept per trace, well above the pixel width of a subplot
+ENVELOPE_POINTS = 2000
+SPECGRAM_NFFT = 256
+
+
+def _slice(signal, xlim, margin=1):
+    fs = signal.sample_frequency
+    start = max(int(np.floor(xlim[0] * fs)) - margin, 0)
+    stop = min(int(np.ceil(xlim[1] * fs)) + margin, signal.signal.shape[-1])
+    return start, stop
+
+
+def envelope(signal, xlim, points=ENVELOPE_POINTS):
+    """
+    Cuts the signal to visible time range and reduces it to interleaved min/max values of at most points bins,
+    so the plotted trace looks the same as the full resolution one.
+    Returns timeline and values ready for plot().
+    """
+    start, stop = _slice(signal, xlim)
+    values = signal.signal[..., start:stop]
+    timeline = np.arange(start, stop) / signal.sample_frequency
+    width = (stop - start) // points
+    if width < 2:
+        return timeline, values.T
+    count = (stop - start) // width * width
+    bins = values[..., :count].reshape(values.shape[:-1] + (-1, width))
+    values = np.stack((bins.min(axis=-1), bins.max(axis=-1)), axis=-1).reshape(values.shape[:-1] + (-1,))
+    timeline = np.repeat(timeline[:count:width], 2)
+    return timeline, values.T
+
+
+def spectrum_envelope(signal, flim, points=ENVELOPE_POINTS):
+    freqline, values = signal.plot_fft()
+    start, stop = np.searchsorted(freqline, flim)
+    freqline, values = freqline[start:stop + 1], values[start:stop + 1]
+    width = len(freqline) // points
+    if width < 2:
+        return freqline, values
+    count = len(freqline) // width * width
+    # Spectrum peaks matter more than the valleys, keep only the maximum in every bin
+    values = values[:count].reshape((-1, width) + values.shape[1:]).max(axis=1)
+    return freqline[:count:width], values
+
+
+def specgram_slice(signal, xlim, flim=None, nfft=SPECGRAM_NFFT):
+    """
+    Spectrogram frames (in dB) of the first trial over the visible time and frequency range, with their extent
+    for imshow(). Only the frames in view are computed, so the cost does not grow with the signal length.
+    """
+    times, freqline, frames = signal.stft(xlim, flim, nfft)
+    if frames.ndim > 2:
+        frames = frames[0]
+    # Every frame and frequency bin is drawn as a cell centred on its time and frequency
+    half_hop = (nfft // 2) / signal.sample_frequency / 2
+    half_bin = signal.sample_frequency / nfft / 2
+    return frames.T, (times[0] - half_hop, times[-1] + half_hop, freqline[0] - half_bin, freqline[-1] + half_bin)
+
+
+def _save(figure, path):
+    FigureCanvasAgg(figure)
+    figure.savefig(path)
+    return path
+
+
+def render_signals(path, panels, xlim):
+    figure = Figure(figsize=(8, 12))
+    figure.suptitle("Przebiegi czasowe sygnału", fontsize="x-large")
+    for i, (name, timeline, values) in enumerate(panels):
+        subplot = figure.add_subplot(len(panels), 1, i + 1)
+        subplot.plot(timeline, values)
+        subplot.grid(True)
+        subplot.set_xlabel("Czas [s]", fontsize="small")
+        subplot.set_ylabel("Wartość [V]", fontsize="small")
+        subplot.set_title("Wyjście: %s" % name)
+        subplot.set_xlim(*xlim)
+    figure.tight_layout(rect=(0, 0, 1, 0.96))
+    return _save(figure, path)
+
+
+def render_spectra(path, panels, flim, ylim):
+    figure = Figure(figsize=(8, 12))
+    figure.suptitle("Wykresy widm Fouriera", fontsize="x-large")
+    for i, (name, freqline, values) in enumerate(panels):
+        subplot = figure.add_subplot(len(panels), 1, i + 1)
+        subplot.set_title("Wyjście: %s" % name)
+        subplot.plot(freqline, values, 'b')
+        subplot.grid(True)
+        subplot.set_xlabel("Częstotliwość [Hz]", fontsize="small")
+        subplot.set_ylabel("Moduł widma [dB]", fontsize="small")
+        subplot.set_xlim(*flim)
+        subplot.set_ylim(*ylim)
+    figure.tight_layout(rect=(0, 0, 1, 0.95))
+    return _save(figure, path)
+
+
+def render_compare(path, timeline, values_in, values_out, error, xlim):
+    figure = Figure(figsize=(8, 4))
+    subplot = figure.add_subplot(1, 1, 1)
+    subplot.set_title("Porównanie sygnału wejściowego i wyjściowego", fontsize="x-large")
+    subplot.plot(timeline, values_in, label="Sygnał modulujący")
+    subplot.plot(timeline, values_out, label="Sygnał zdemodulowany", alpha=0.5)
+    subplot.plot(timeline, error, 'r', label="Błąd demodulacji")
+    subplot.grid(True)
+    subplot.set_xlabel("Czas [s]", fontsize="small")
+    subplot.set_ylabel("Wartość [V]", fontsize="small")
+    subplot.legend(loc="best", fancybox=True, framealpha=0.5)
+    subplot.set_xlim(*xlim)
+    subplot.set_ylim(-1.1, 1.1)
+    return _save(figure, path)
+
+
+def render_spectrograms(path, panels, xlim, ylim):
+    figure = Figure(figsize=(8, 12))
+    figure.suptitle("Spektrogramy", fontsize="large")
+    for i, (title, frames, extent) in enumerate(panels):
+        subplot = figure.add_subplot(len(panels), 1, i + 1)
+        subplot.imshow(frames, origin='lower', aspect='auto', extent=extent)
+        subplot.set_title(title)
+        subplot.set_xlabel("czas [s]")
+        subplot.set_ylabel("częstotliwość [Hz]")
+        subplot.axis('tight')
+        subplot.set_ylim(*ylim)
+        subplot.set_xlim(*xlim)
+        subplot.grid()
+    figure.tight_layout(rect=(0, 0, 1, 0.95))
+    return _save(figure, path)
+
+
+def _render(task):
+    function, args = task
+    return function(*args)
+
+
+def render_all(tasks, jobs=None):
+    """
+    Renders (function, args) tasks in worker processes, only the reduced plot data is sent to them.
+    Returns paths of the saved figures.
+    """
+    if jobs == 1:
+        return [_render(task) for task in tasks]
+    with ProcessPoolExecutor(max_workers=jobs or min(len(tasks), os.cpu_count())) as executor:
+        return list(executor.map(_render, tasks))
@@ -0,0 +1,197 @@
+import json
+import os
+
+import numpy as np
+
+import blocks
+import streamio
+from cache import ResultCache
+from metrics import ErrorStatistics
+from system import SystemConfiguration
+from blocks import SineGeneratorBlock, PhaseModulatorBlock, AWGNChannelBlock, BandPassFilterBlock, \
+    PhaseDemodulatorBlock, DownConverterBlock, LowPassFilterBlock, ChannelizerBlock
+
+__author__ = 'Wojciech Urbański'
+
+
+def pm_system(modulator_freq=10, phase_dev=2, carrier_frequency=100, carrier_amplitude=1, snr=15,
+              sample_freq=None, simulation_time=None, seed=None, trials=None, scratch_dir=None,
+              dtype=np.float64, sos=False, cache_dir=None, bit_generator="PCG64", decimation=None, verbose=False):
+    """
+    Creates the phase modulation chain used by PMApplication, without any plotting.
+    Sample frequency and simulation time default to 64 samples per carrier period and 640 carrier periods.
+    With trials set, noisy signals get a leading axis of that many Monte-Carlo trials.
+    With scratch_dir set, block outputs are memory-mapped from .npy files in that directory.
+    dtype selects float32 or float64 precision of all signals, sos switches the band-pass filter
+    to second-order sections (always used in float32). With cache_dir set, outputs of already
+    computed stages with the same parameters are loaded from a persistent cache in that directory.
+    seed and bit_generator ("PCG64", "Philox", ...) select the random streams of the noise.
+    With decimation set, the channel output is mixed down to baseband and decimated by that factor instead of
+    being band-pass filtered, the low-pass filter and the demodulator run at the reduced sample rate.
+
+    :rtype : SystemConfiguration
+    """
+    if sample_freq is None:
+        sample_freq = 64 * carrier_frequency
+    if simulation_time is None:
+        simulation_time = 640 / carrier_frequency
+    bandwidth = 2 * (modulator_freq + phase_dev)
+
+    config = SystemConfiguration(simulation_time, sample_freq, trials=trials, scratch_dir=scratch_dir,
+                                 dtype=dtype, cache=ResultCache(cache_dir) if cache_dir is not None else None,
+                                 seed=seed, bit_generator=bit_generator)
+    config.add_blocks([SineGeneratorBlock(config, modulator_freq),
+                       PhaseModulatorBlock(config, carrier_frequency, carrier_amplitude, phase_dev),
+                       AWGNChannelBlock(config, snr=snr, seed=seed)])
+    if decimation is None:
+        config.add_block(BandPassFilterBlock(config, low_freq=0.9 * (carrier_frequency - bandwidth / 2),
+                                             high_freq=1.1 * (carrier_frequency + bandwidth / 2), sos=sos))
+    else:
+        # Low-pass filter at baseband passes the same band as the band-pass filter around the carrier
+        config.add_blocks([DownConverterBlock(config, carrier_frequency, decimation),
+                           LowPassFilterBlock(config, high_freq=0.1 * carrier_frequency + 0.55 * bandwidth, sos=sos)])
+    config.add_block(PhaseDemodulatorBlock(config, frequency=carrier_frequency, deviation=phase_dev))
+    config.connect_blocks(verbose)
+    return config
+
+
+def fdm_system(carrier_frequencies, modulator_frequencies, phase_dev=2, carrier_amplitude=1, snr=15,
+               decimation=None, sample_freq=None, simulation_time=None, seed=None, trials=None, dtype=np.float64,
+               cache_dir=None, bit_generator="PCG64", verbose=False):
+    """
+    Creates a frequency-division multiplex of phase modulated channels, one per carrier in carrier_frequencies,
+    simulated in a single chain: all channels are modulated into one signal, passed through a common AWGN
+    channel (snr of the whole multiplex) and separated by a ChannelizerBlock. modulator_frequencies, phase_dev
+    and carrier_amplitude are given per channel or as one value for all of them. Signals of the separated
+    channels have the channel axis before the samples. Sample frequency defaults to 4 times the highest
+    carrier, decimation to the largest factor keeping the output sample rate at least 4 channel spacings.
+    Each channel is low-pass filtered to half of the channel spacing.
+
+    :rtype : SystemConfiguration
+    """
+    carriers = np.atleast_1d(carrier_frequencies).astype(float)
+    channels = len(carriers)
+    modulators, deviations, amplitudes = (np.broadcast_to(value, (channels,)).astype(float).tolist()
+                                          for value in (modulator_frequencies, phase_dev, carrier_amplitude))
+    if sample_freq is None:
+        sample_freq = 4 * carriers.max()
+    if simulation_time is None:
+        simulation_time = 20 / min(modulators)
+    spacing = np.min(np.diff(np.sort(carriers))) if channels > 1 else sample_freq / 8
+    if decimation is None:
+        decimation = max(2, int(sample_freq / (4 * spacing)))
+
+    config = SystemConfiguration(simulation_time, sample_freq, trials=trials, dtype=dtype,
+                                 cache=ResultCache(cache_dir) if cache_dir is not None else None,
+                                 seed=seed, bit_generator=bit_generator)
+    config.add_blocks([SineGeneratorBlock(config, modulators),
+                       PhaseModulatorBlock(config, carriers.tolist(), amplitudes, deviations),
+                       AWGNChannelBlock(config, snr=snr, seed=seed),
+                       ChannelizerBlock(config, carriers, decimation),
+                       LowPassFilterBlock(config, high_freq=min(spacing / 2, 0.45 * sample_freq / decimation)),
+                       PhaseDemodulatorBlock(config, frequency=carriers.tolist(), deviation=deviations)])
+    config.connect_blocks(verbose)
+    return config
+
+
+def mse(config):
+    """
+    Mean squared error between the modulating signal and the demodulated output, one value per trial.
+    Output at a sample rate lower by an integer factor is compared with every factor-th input sample.
+    """
+    reference, output = config.blocks[0].output, config.blocks[-1].output
+    step = reference.sample_frequency / output.sample_frequency
+    if step != int(step):
+        raise ValueError("Częstotliwości próbkowania wejścia i wyjścia nie są wielokrotnościami.")
+    return ErrorStatistics().update(reference.signal[..., ::int(step)], output.signal).mse
+
+
+def build_system(description, cache_dir=None):
+    """
+    Creates the system described by a scenario, a dictionary read from a YAML or JSON file.
+    Without a "blocks" list the keys are pm_system() arguments, e.g. {"snr": 10, "seed": 1}, or fdm_system()
+    arguments when "carrier_frequencies" are given.
+    Otherwise the keys are SystemConfiguration arguments and "blocks" lists the blocks, e.g.
+    {"type": "AWGNChannelBlock", "snr": 10}. Blocks are chained in order, unless some of them give
+    "inputs" mapping input names to the "id" (or "id.output") of other blocks; then only those are connected.
+
+    :rtype : SystemConfiguration
+    """
+    description = dict(description)
+    description.pop("name", None)
+    cache_dir = description.pop("cache_dir", cache_dir)
+    if "blocks" not in description:
+        if "carrier_frequencies" in description:
+            return fdm_system(cache_dir=cache_dir, **description)
+        return pm_system(cache_dir=cache_dir, **description)
+    specs = description.pop("blocks")
+    config = SystemConfiguration(cache=ResultCache(cache_dir) if cache_dir is not None else None, **description)
+    identifiers = {}
+    connections = []
+    for index, spec in enumerate(specs):
+        spec = dict(spec)
+        kind = spec.pop("type", None)
+        block_type = getattr(blocks, str(kind), None) or getattr(streamio, str(kind), None)
+        if not (isinstance(block_type, type) and issubclass(block_type, blocks.Block)):
+            raise ValueError("Nieznany typ bloku: %s" % kind)
+        identifier = str(spec.pop("id", index))
+        inputs = spec.pop("inputs", None)
+        block = block_type(config, **spec)
+        config.add_block(block)
+        identifiers[identifier] = block
+        if inputs:
+            connections.append((block, inputs))
+    if not connections:
+        config.connect_blocks(verbose=False)
+    for block, inputs in connections:
+        for input, source in inputs.items():
+            source, _, output = str(source).partition(".")
+            if source not in identifiers:
+                raise ValueError("Nieznany blok: %s" % source)
+            config.connect(identifiers[source], block, output or "output", input)
+    return config
+
+
+def load_scenarios(path):
+    """
+    Reads scenarios from a YAML (.yaml, .yml) or JSON file holding a single scenario, a list of them
+    or a dictionary with a "scenarios" list. Scenarios without a "name" are named after the file.
+    """
+    with open(path) as f:
+        if os.path.splitext(path)[1].lower() in (".yaml", ".yml"):
+            try:
+                import yaml
+            except ImportError:
+                raise ImportError("Odczyt scenariuszy YAML wymaga pakietu PyYAML.") from None
+            content = yaml.safe_load(f)
+        else:
+            content = json.load(f)
+    if isinstance(content, dict):
+        content = content.get("scenarios", [content])
+    if not isinstance(content, list) or not all(isinstance(scenario, dict) for scenario in content):
+        raise ValueError("Nieprawidłowy plik scenariuszy: %s" % path)
+    name = os.path.splitext(os.path.basename(path))[0]
+    return [dict({"name": name if len(content) == 1 else "%s[%d]" % (name, index)}, **scenario)
+            for index, scenario in enumerate(content)]
+
+
+def precision_report(seed=0, trials=100):
+    """
+    Compares MSE of the default scenario simulated in float32 against float64, using the same noise.
+    float32 always filters with second-order sections, so float64 is reported for both filter structures.
+    """
+    reference = mse(pm_system(seed=seed, trials=trials, dtype=np.float64))
+    reference_sos = mse(pm_system(seed=seed, trials=trials, dtype=np.float64, sos=True))
+    single = mse(pm_system(seed=seed, trials=trials, dtype=np.float32))
+    print("MSE float64:       %.6e" % np.mean(reference))
+    print("MSE float64 (SOS): %.6e" % np.mean(reference_sos))
+    print("MSE float32 (SOS): %.6e" % np.mean(single))
+    for label, base in (("float64", reference), ("float64 (SOS)", reference_sos)):
+        delta = single.astype(np.float64) - base
+        print("Różnica MSE względem %s: średnio %.3e, maksymalnie %.3e (%.4f%%)"
+              % (label, np.mean(delta), np.max(np.abs(delta)), 100 * np.max(np.abs(delta) / base)))
+    return reference, reference_sos, single
+
+
+if __name__ == '__main__':
+    precision_report()
@@ -1,26 +1,250 @@
 __author__ = 'Wojciech Urbański'
 
+from functools import lru_cache
+
 import numpy as np
 import numpy.fft as fft
+from numpy.lib.stride_tricks import sliding_window_view
+
+# Default frame length of spectrograms, the same as in matplotlib's specgram()
+STFT_NFFT = 256
+
+
+@lru_cache(maxsize=32)
+def _hanning(length):
+    window = np.hanning(length)
+    window.flags.writeable = False
+    return window
+
+
+@lru_cache(maxsize=32)
+def _frequency_bins(nfft, sample_frequency, complex):
+    if complex:
+        bins = fft.fftshift(fft.fftfreq(nfft, 1 / sample_frequency))
+    else:
+        bins = fft.rfftfreq(nfft, 1 / sample_frequency)
+    bins.flags.writeable = False
+    return bins
+
+
+class STFT():
+    """
+    Short-time Fourier transform computed frame by frame. Frame k holds nfft samples starting at k * hop,
+    windowed with the cached Hann window; numpy.fft keeps its plans for every length it has seen. Only frames
+    asked for are computed and their magnitudes are returned as float32, in dB with db set. Complex signals
+    get the whole spectrum, shifted so the frequencies increase.
+    """
+    def __init__(self, sample_frequency, nfft=STFT_NFFT, hop=None, db=True, complex=False):
+        if nfft < 1 or (hop is not None and hop < 1):
+            raise ValueError("Długość ramki i przesunięcie między ramkami muszą być dodatnie.")
+        self._sample_frequency = sample_frequency
+        self._nfft = nfft
+        self._hop = max(nfft // 2, 1) if hop is None else hop
+        self._db = db
+        self._complex = complex
+        self.reset()
+
+    @property
+    def nfft(self):
+        return self._nfft
+
+    @property
+    def hop(self):
+        return self._hop
+
+    @property
+    def frequencies(self):
+        return _frequency_bins(self._nfft, self._sample_frequency, self._complex)
+
+    def frame_count(self, length):
+        """
+        Number of whole frames in a signal of given length.
+        """
+        return max(0, (length - self._nfft) // self._hop + 1)
+
+    def frame_times(self, start, stop):
+        """
+        Times of the centres of frames start to stop.
+        """
+        return (np.arange(start, stop) * self._hop + self._nfft / 2) / self._sample_frequency
+
+    def frame_range(self, length, xlim):
+        """
+        Frames of a signal of given length covering the time range xlim, from the last one centred at or before
+        its start to the first one centred at or after its end.
+        """
+        centre = self._nfft / 2
+        start = int(np.floor((xlim[0] * self._sample_frequency - centre) / self._hop))
+        stop = int(np.ceil((xlim[1] * self._sample_frequency - centre) / self._hop)) + 1
+        count = self.frame_count(length)
+        return min(max(start, 0), count), min(max(stop, 0), count)
+
+    def transform(self, samples):
+        """
+        Magnitudes of frames given as an array (..., frames, nfft).
+        """
+        spectrum = samples * _hanning(self._nfft)
+        if self._complex:
+            spectrum = fft.fftshift(fft.fft(spectrum, axis=-1), axes=-1)
+        else:
+            spectrum = fft.rfft(spectrum, axis=-1)
+        magnitude = np.abs(spectrum).astype(np.float32)
+        if self._db:
+            # Floor keeps log10() finite for silent frames
+            np.maximum(magnitude, np.finfo(np.float32).tiny, out=magnitude)
+            np.log10(magnitude, out=magnitude)
+            magnitude *= 20
+        return magnitude
+
+    def frames(self, signal, start, stop):
+        """
+        Magnitudes of frames start to stop of a whole signal, shape (..., frames, bins).
+        Only the samples of these frames are read, so memory-mapped signals stay on disk.
+        """
+        if stop <= start:
+            return np.empty(signal.shape[:-1] + (0, len(self.frequencies)), np.float32)
+        samples = signal[..., start * self._hop:(stop - 1) * self._hop + self._nfft]
+        windows = sliding_window_view(samples, self._nfft, axis=-1)[..., ::self._hop, :]
+        return self.transform(windows)
+
+    def reset(self):
+        """
+        Starts a new signal for update().
+        """
+        self._pending = None
+        self._position = 0
+
+    @property
+    def position(self):
+        """
+        Index of the next frame returned by update().
+        """
+        return self._position
+
+    def update(self, chunk):
+        """
+        Takes the next chunk of a streamed signal, returns magnitudes of the frames completed by it.
+        Only the samples of the frame not yet completed are kept between calls.
+        """
+        if self._pending is not None:
+            chunk = np.concatenate((self._pending, chunk), axis=-1)
+        count = self.frame_count(chunk.shape[-1])
+        magnitudes = self.frames(chunk, 0, count)
+        self._pending = chunk[..., count * self._hop:]
+        self._position += count
+        return magnitudes
 
 
 class Signal():
     def __init__(self, signal_array, sample_frequency):
+        # Signal is either 1-D or has a leading trial axis (trials, samples)
         self.signal = signal_array
-        self._length = len(self.signal)
         self._sample_frequency = sample_frequency
 
+    @property
+    def signal(self):
+        return self._signal
+
+    @signal.setter
+    def signal(self, signal_array):
+        self._signal = signal_array
+        self._length = signal_array.shape[-1]
+        # Spectrum is computed lazily and kept until the samples change
+        self._spectrum = None
+        self._frames = {}
+
     def _calculate_fft(self):
-        spectrum = fft.fftshift(fft.fft(self.signal * np.hanning(self._length)))
-        return spectrum[len(spectrum) / 2:] / np.max(np.abs(spectrum))
+        if self._spectrum is None:
+            # Spectrum of a real signal is symmetric, only the non-negative half is computed
+            if np.iscomplexobj(self.signal):
+                spectrum = fft.fftshift(fft.fft(self.signal * _hanning(self._length), axis=-1), axes=-1)
+            else:
+                spectrum = fft.rfft(self.signal * _hanning(self._length), axis=-1)
+            self._spectrum = spectrum / np.max(np.abs(spectrum), axis=-1, keepdims=True)
+        return self._spectrum
+
+    @classmethod
+    def load(cls, path, sample_frequency):
+        """
+        Loads signal saved with save(), samples are memory-mapped read-only instead of being read into memory.
+
+        :rtype : Signal
+        """
+        return cls(np.load(path, mmap_mode='r'), sample_frequency)
+
+    def save(self, path):
+        np.save(path, self.signal)
+
+    @property
+    def sample_frequency(self):
+        return self._sample_frequency
+
+    @property
+    def duration(self):
+        return self._length / self._sample_frequency
+
+    @property
+    def timeline(self):
+        """
+        Sample times of the signal, from its own sample frequency.
+        """
+        return np.arange(self._length) / self._sample_frequency
+
+    @property
+    def trials(self):
+        return None if self.signal.ndim == 1 else self.signal.shape[0]
 
     def get_energy(self):
-        return np.var(self.signal)
+        return np.var(self.signal, axis=-1)
+
+    def get_psd(self, nperseg=4096):
+        """
+        Averaged power spectral density (Welch method), avoids a single FFT over very long signals.
+        """
+        from scipy.signal import welch
+        return welch(self.signal, self._sample_frequency, window='hann', nperseg=min(nperseg, self._length),
+                     axis=-1)
 
     def plot(self):
-        timeline = np.arange(0, self._length/self._sample_frequency, 1/self._sample_frequency)
-        return timeline, self.signal
+        timeline = self.timeline
+        # matplotlib plots columns, every trial becomes a separate line
+        return timeline, self.signal.T
 
     def plot_fft(self):
-        freqline = fft.fftshift(fft.fftfreq(self._length, 1 / self._sample_frequency))
-        return freqline[len(freqline) / 2:], 20 * np.log10(abs(self._calculate_fft()))
+        if np.iscomplexobj(self.signal):
+            freqline = fft.fftshift(fft.fftfreq(self._length, 1 / self._sample_frequency))
+        else:
+            freqline = fft.rfftfreq(self._length, 1 / self._sample_frequency)
+        return freqline, 20 * np.log10(abs(self._calculate_fft())).T
+
+    def stft(self, xlim=None, flim=None, nfft=STFT_NFFT, hop=None, db=True):
+        """
+        Spectrogram of the signal over the time range xlim and frequency range flim (whole signal by default).
+        Frames are computed only for the requested time range and kept with the signal, a later call for
+        an overlapping range computes just the frames not seen yet. Returns frame times, frequencies and
+        float32 magnitudes of shape (..., frames, frequencies).
+        """
+        engine, first, frames = self._frames.get((nfft, hop, db), (None, 0, None))
+        if engine is None:
+            engine = STFT(self._sample_frequency, nfft, hop, db, np.iscomplexobj(self.signal))
+        if xlim is None:
+            start, stop = 0, engine.frame_count(self._length)
+        else:
+            start, stop = engine.frame_range(self._length, xlim)
+        if frames is None or start > first + frames.shape[-2] or stop < first:
+            # Cached frames do not touch the requested range, they are replaced
+            first, frames = start, engine.frames(self.signal, start, stop)
+        else:
+            last = first + frames.shape[-2]
+            before = engine.frames(self.signal, start, first) if start < first else frames[..., :0, :]
+            after = engine.frames(self.signal, last, stop) if stop > last else frames[..., :0, :]
+            first, frames = min(start, first), np.concatenate((before, frames, after), axis=-2)
+        self._frames[(nfft, hop, db)] = (engine, first, frames)
+        freqline = engine.frequencies
+        low, high = (0, len(freqline)) if flim is None else np.searchsorted(freqline, flim)
+        return (engine.frame_times(start, stop), freqline[low:high + 1],
+                frames[..., start - first:stop - first, low:high + 1])
+
+    def plot_psd(self, nperseg=4096):
+        freqline, psd = self.get_psd(nperseg)
+        return freqline, 10 * np.log10(psd / np.max(psd, axis=-1, keepdims=True)).T
@@ -0,0 +1,553 @@
+import collections
+import socket
+import threading
+import time
+import wave
+
+import numpy as np
+
+from blocks import Block, parameter
+
+__author__ = 'Wojciech Urbański'
+
+# Samples kept between a source or sink and the chain, and samples moved by the I/O thread at once
+BUFFER_SIZE = 2 ** 16
+TRANSFER_SIZE = 4096
+# Integer PCM sample types of WAV files by sample width in bytes
+WAV_DTYPES = {1: np.dtype(np.uint8), 2: np.dtype('<i2'), 4: np.dtype('<i4')}
+
+
+class RingBuffer():
+    """
+    Bounded FIFO of samples between a producer and a consumer thread. write() waits while the buffer is full,
+    which slows the producer down to the speed of the consumer (back-pressure). After close() nothing more
+    is written and read() returns the remaining samples, then empty arrays.
+    """
+    def __init__(self, capacity, dtype=np.float64):
+        if capacity < 1:
+            raise ValueError("Rozmiar bufora musi być większy niż 0.")
+        self._data = np.empty(capacity, dtype)
+        self._head = 0
+        self._size = 0
+        self._closed = False
+        self._condition = threading.Condition()
+        # Number of samples written up to the end of every write, with the time of the write
+        self._arrivals = collections.deque()
+        self._written = 0
+        self._consumed = 0
+        self.max_depth = 0
+        self.blocked_time = 0.0
+
+    @property
+    def capacity(self):
+        return len(self._data)
+
+    @property
+    def depth(self):
+        return self._size
+
+    @property
+    def closed(self):
+        return self._closed
+
+    def write(self, samples):
+        """
+        Appends samples, waiting for free space. Returns number of samples written, less than given
+        only if the buffer was closed in the meantime.
+        """
+        samples = np.asarray(samples).reshape(-1)
+        capacity = len(self._data)
+        done = 0
+        with self._condition:
+            while done < len(samples):
+                start = time.perf_counter()
+                while self._size == capacity and not self._closed:
+                    self._condition.wait()
+                self.blocked_time += time.perf_counter() - start
+                if self._closed:
+                    break
+                count = min(len(samples) - done, capacity - self._size)
+                tail = (self._head + self._size) % capacity
+                first = min(count, capacity - tail)
+                self._data[tail:tail + first] = samples[done:done + first]
+                self._data[:count - first] = samples[done + first:done + count]
+                self._size += count
+                self._written += count
+                self._arrivals.append((self._written, time.perf_counter()))
+                self.max_depth = max(self.max_depth, self._size)
+                done += count
+                self._condition.notify_all()
+        return done
+
+    def read(self, count, minimum=None):
+        """
+        Takes at most count samples, waiting until at least minimum (count by default) are available
+        or the buffer is closed. Returns the samples and arrival time of the oldest of them (None if empty).
+        """
+        minimum = count if minimum is None else minimum
+        capacity = len(self._data)
+        with self._condition:
+            while self._size < minimum and not self._closed:
+                self._condition.wait()
+            count = min(count, self._size)
+            samples = np.empty(count, self._data.dtype)
+            first = min(count, capacity - self._head)
+            samples[:first] = self._data[self._head:self._head + first]
+            samples[first:] = self._data[:count - first]
+            self._head = (self._head + count) % capacity
+            self._size -= count
+            while self._arrivals and self._arrivals[0][0] <= self._consumed:
+                self._arrivals.popleft()
+            arrival = self._arrivals[0][1] if count and self._arrivals else None
+            self._consumed += count
+            self._condition.notify_all()
+        return samples, arrival
+
+    def close(self):
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+
+    def stats(self):
+        return {"capacity": self.capacity, "max_depth": self.max_depth, "blocked_time": self.blocked_time}
+
+
+class StreamStats():
+    """
+    Throughput and latency of a streaming run. Latency of a chunk is the time from arrival of its oldest sample
+    at a source block (or from the start of the chunk without sources) until the whole chain processed it.
+    """
+    def __init__(self):
+        self.samples = 0
+        self.latencies = []
+        # Ring buffer statistics of source and sink blocks, by block name
+        self.buffers = {}
+        self._start = time.perf_counter()
+        self._end = self._start
+
+    def record(self, samples, arrival):
+        self._end = time.perf_counter()
+        self.samples += samples
+        self.latencies.append(self._end - arrival)
+
+    def summary(self):
+        elapsed = self._end - self._start
+        latencies = np.array(self.latencies) if self.latencies else np.zeros(1)
+        return {"samples": self.samples, "chunks": len(self.latencies), "elapsed": elapsed,
+                "samples_per_second": self.samples / elapsed if elapsed > 0 else 0.0,
+                "latency_mean": float(np.mean(latencies)), "latency_p50": float(np.percentile(latencies, 50)),
+                "latency_p99": float(np.percentile(latencies, 99)), "latency_max": float(np.max(latencies)),
+                "buffers": self.buffers}
+
+    def print_summary(self):
+        summary = self.summary()
+        print("Próbek: %d w %.3f s (%.0f próbek/s)" % (summary["samples"], summary["elapsed"],
+                                                       summary["samples_per_second"]))
+        print("Opóźnienie: średnio %.2f ms, mediana %.2f ms, 99%% %.2f ms, maksymalnie %.2f ms"
+              % tuple(1000 * summary[key] for key in ("latency_mean", "latency_p50", "latency_p99", "latency_max")))
+        for name, buffer in summary["buffers"].items():
+            print("%s: bufor %d, maksymalnie zajęte %d, oczekiwanie %.3f s"
+                  % (name, buffer["capacity"], buffer["max_depth"], buffer["blocked_time"]))
+
+
+def _connect(address):
+    # Path of a UNIX socket or (host, port) of a TCP server
+    if isinstance(address, str):
+        connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        connection.connect(address)
+        return connection
+    return socket.create_connection(address)
+
+
+def _pcm_to_float(data, width):
+    samples = np.frombuffer(data, WAV_DTYPES[width])
+    if width == 1:
+        return (samples - 128.0) / 128
+    return samples / float(2 ** (8 * width - 1))
+
+
+def _float_to_pcm(samples, width):
+    scale = 2 ** (8 * width - 1)
+    data = np.clip(np.round(np.asarray(samples, np.float64) * scale), -scale, scale - 1)
+    if width == 1:
+        data += 128
+    return data.astype(WAV_DTYPES[width]).tobytes()
+
+
+class _StreamBlock(Block):
+    # Common part of sources and sinks: the ring buffer and the thread moving samples through it
+    def __init__(self, config, buffer_size=BUFFER_SIZE, transfer_size=TRANSFER_SIZE, name="Blok wejścia-wyjścia"):
+        self._buffer_size = buffer_size
+        self._transfer_size = transfer_size
+        self._ring = None
+        self._thread = None
+        self._error = None
+        self._buffer_stats = None
+        super().__init__(config, name)
+
+    @property
+    def _deterministic(self):
+        # Files and connections may change between runs, outputs are never taken from the cache
+        return False
+
+    def _open(self):
+        raise NotImplementedError
+
+    def _close(self):
+        pass
+
+    def _interrupt(self):
+        # Wakes up the I/O thread waiting for the file or connection, called before it is joined
+        pass
+
+    def _start(self, target):
+        self._open()
+        self._error = None
+        self._ring = RingBuffer(self._buffer_size, self._config.dtype)
+        self._thread = threading.Thread(target=target, name=self.name, daemon=True)
+        self._thread.start()
+
+    def _stop(self):
+        # Returns error of the I/O thread, if any
+        if self._ring is None:
+            return None
+        self._ring.close()
+        self._interrupt()
+        self._thread.join()
+        self._buffer_stats = self._ring.stats()
+        self._ring = None
+        self._thread = None
+        self._close()
+        return self._error
+
+    def reset(self):
+        self._stop()
+        self.arrival = None
+
+    @property
+    def buffer_stats(self):
+        """
+        Capacity, maximum number of samples held and time spent waiting for free space in the ring buffer.
+        """
+        return self._ring.stats() if self._ring is not None else self._buffer_stats
+
+
+class SourceBlock(_StreamBlock):
+    """
+    Block feeding samples from outside the system. In streaming mode a reader thread moves samples
+    into a ring buffer of buffer_size samples. When the buffer is full the thread stops reading, so
+    the producer is slowed down to the speed of the chain. A chunk shorter than requested marks
+    the end of the stream. In batch mode the timeline is filled with samples from the start of the
+    stream, zero-padded if it is shorter.
+    """
+    def _read_samples(self, count):
+        # At most count samples, empty array at the end of the stream
+        raise NotImplementedError
+
+    def _process(self):
+        signal = np.zeros(self._config.length, self._config.dtype)
+        self._open()
+        try:
+            position = 0
+            while position < len(signal):
+                samples = self._read_samples(len(signal) - position)
+                if len(samples) == 0:
+                    break
+                signal[position:position + len(samples)] = samples
+                position += len(samples)
+        finally:
+            self._close()
+        return self._signal(signal)
+
+    def _produce(self):
+        try:
+            while True:
+                samples = self._read_samples(self._transfer_size)
+                if len(samples) == 0 or self._ring.write(samples) < len(samples):
+                    break
+        except Exception as error:
+            # Raised in the thread running the chain
+            if not self._ring.closed:
+                self._error = error
+        finally:
+            self._ring.close()
+
+    def _process_chunk(self, chunk):
+        if self._ring is None:
+            self._start(self._produce)
+        samples, self.arrival = self._ring.read(chunk.shape[-1])
+        if self._error is not None:
+            raise self._error
+        return samples
+
+    def close(self):
+        self._stop()
+
+
+class SinkBlock(_StreamBlock):
+    """
+    Block writing its input outside the system, the input is passed on unchanged. In streaming mode
+    a writer thread takes samples from a ring buffer of buffer_size samples. When the output is slower
+    than the chain, process_chunk() waits for free space. close() writes out the remaining samples.
+    """
+    def _write_samples(self, samples):
+        raise NotImplementedError
+
+    def _process(self):
+        signal = self.input
+        if signal.signal.ndim > 1:
+            raise ValueError("Blok wyjściowy obsługuje tylko pojedynczy przebieg.")
+        self._open()
+        try:
+            self._write_samples(signal.signal)
+        finally:
+            self._close()
+        return signal
+
+    def _consume(self):
+        try:
+            while True:
+                samples, _ = self._ring.read(self._transfer_size, minimum=1)
+                if len(samples) == 0:
+                    break
+                self._write_samples(samples)
+        except Exception as error:
+            self._error = error
+            self._ring.close()
+
+    def _process_chunk(self, chunk):
+        if chunk.ndim > 1:
+            raise ValueError("Blok wyjściowy obsługuje tylko pojedynczy przebieg.")
+        if self._ring is None:
+            self._start(self._consume)
+        self._ring.write(chunk)
+        if self._error is not None:
+            raise self._error
+        return chunk
+
+    def close(self):
+        error = self._stop()
+        if error is not None:
+            raise error
+
+
+class RawFileSourceBlock(SourceBlock):
+    """
+    Samples of sample_dtype stored in a raw binary file from offset bytes on, read through a memory map.
+    """
+    def __init__(self, config, path, sample_dtype="float32", offset=0, buffer_size=BUFFER_SIZE,
+                 transfer_size=TRANSFER_SIZE, name="Źródło: plik"):
+        self._path = path
+        self._sample_dtype = np.dtype(sample_dtype)
+        self._offset = offset
+        super().__init__(config, buffer_size, transfer_size, name)
+
+    path = parameter("_path")
+    offset = parameter("_offset")
+
+    def _open(self):
+        self._map = np.memmap(self._path, dtype=self._sample_dtype, mode='r', offset=self._offset)
+        self._position = 0
+
+    def _read_samples(self, count):
+        samples = self._map[self._position:self._position + count]
+        self._position += len(samples)
+        return samples
+
+    def _close(self):
+        self._map = None
+
+
+class WavSourceBlock(SourceBlock):
+    """
+    Samples of one channel of a PCM WAV file (8, 16 or 32 bit), scaled to [-1, 1). Sample rate of the file
+    has to match the system.
+    """
+    def __init__(self, config, path, channel=0, buffer_size=BUFFER_SIZE, transfer_size=TRANSFER_SIZE,
+                 name="Źródło: plik WAV"):
+        self._path = path
+        self._channel = channel
+        super().__init__(config, buffer_size, transfer_size, name)
+
+    path = parameter("_path")
+    channel = parameter("_channel")
+
+    def _open(self):
+        self._wave = wave.open(self._path, 'rb')
+        try:
+            if self._wave.getframerate() != self._config.sample_frequency:
+                raise ValueError("Częstotliwość próbkowania pliku %s (%d Hz) jest inna niż systemu (%g Hz)."
+                                 % (self._path, self._wave.getframerate(), self._config.sample_frequency))
+            if self._wave.getsampwidth() not in WAV_DTYPES:
+                raise ValueError("Nieobsługiwana rozdzielczość próbek pliku %s." % self._path)
+            if not 0 <= self._channel < self._wave.getnchannels():
+                raise ValueError("Plik %s nie ma kanału %d." % (self._path, self._channel))
+        except ValueError:
+            self._wave.close()
+            raise
+
+    def _read_samples(self, count):
+        samples = _pcm_to_float(self._wave.readframes(count), self._wave.getsampwidth())
+        return samples[self._channel::self._wave.getnchannels()]
+
+    def _close(self):
+        self._wave.close()
+
+
+class PipeSourceBlock(SourceBlock):
+    """
+    Samples of sample_dtype read from a binary stream: an open file object (e.g. sys.stdin.buffer)
+    or path of a named pipe. The stream ends when the writer closes it.
+    """
+    def __init__(self, config, stream, sample_dtype="float32", buffer_size=BUFFER_SIZE,
+                 transfer_size=TRANSFER_SIZE, name="Źródło: potok"):
+        self._stream = stream
+        self._sample_dtype = np.dtype(sample_dtype)
+        super().__init__(config, buffer_size, transfer_size, name)
+
+    stream = parameter("_stream")
+
+    def _open(self):
+        self._file = open(self._stream, 'rb') if isinstance(self._stream, str) else self._stream
+        self._remainder = b""
+
+    def _read_samples(self, count):
+        size = self._sample_dtype.itemsize
+        # read1() returns whatever is available instead of waiting for the whole request
+        read = getattr(self._file, "read1", self._file.read)
+        while True:
+            data = read(max(1, count * size - len(self._remainder)))
+            if not data:
+                return np.empty(0, self._sample_dtype)
+            data = self._remainder + data
+            usable = len(data) - len(data) % size
+            self._remainder = data[usable:]
+            if usable:
+                return np.frombuffer(data[:usable], self._sample_dtype)
+
+    def _close(self):
+        if isinstance(self._stream, str):
+            self._file.close()
+
+
+class SocketSourceBlock(PipeSourceBlock):
+    """
+    Samples of sample_dtype received from a socket connected to address: path of a UNIX socket
+    or (host, port) of a TCP server.
+    """
+    def __init__(self, config, address, sample_dtype="float32", buffer_size=BUFFER_SIZE,
+                 transfer_size=TRANSFER_SIZE, name="Źródło: gniazdo"):
+        self._address = address
+        super().__init__(config, None, sample_dtype, buffer_size, transfer_size, name)
+
+    address = parameter("_address")
+
+    def _open(self):
+        self._socket = _connect(self._address)
+        self._file = self._socket.makefile('rb')
+        self._remainder = b""
+
+    def _interrupt(self):
+        try:
+            self._socket.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+    def _close(self):
+        self._file.close()
+        self._socket.close()
+
+
+class RawFileSinkBlock(SinkBlock):
+    """
+    Writes the input to a raw binary file as samples of sample_dtype.
+    """
+    def __init__(self, config, path, sample_dtype="float32", buffer_size=BUFFER_SIZE, transfer_size=TRANSFER_SIZE,
+                 name="Wyjście: plik"):
+        self._path = path
+        self._sample_dtype = np.dtype(sample_dtype)
+        super().__init__(config, buffer_size, transfer_size, name)
+
+    path = parameter("_path")
+
+    def _open(self):
+        self._file = open(self._path, 'wb')
+
+    def _write_samples(self, samples):
+        self._file.write(np.asarray(samples, self._sample_dtype).tobytes())
+
+    def _close(self):
+        self._file.close()
+
+
+class WavSinkBlock(SinkBlock):
+    """
+    Writes the input to a mono PCM WAV file with sample_width bytes per sample, [-1, 1) is the full scale.
+    """
+    def __init__(self, config, path, sample_width=2, buffer_size=BUFFER_SIZE, transfer_size=TRANSFER_SIZE,
+                 name="Wyjście: plik WAV"):
+        if sample_width not in WAV_DTYPES:
+            raise ValueError("Nieobsługiwana rozdzielczość próbek: %d B." % sample_width)
+        self._path = path
+        self._sample_width = sample_width
+        super().__init__(config, buffer_size, transfer_size, name)
+
+    path = parameter("_path")
+
+    def _open(self):
+        self._wave = wave.open(self._path, 'wb')
+        self._wave.setnchannels(1)
+        self._wave.setsampwidth(self._sample_width)
+        self._wave.setframerate(int(round(self._config.sample_frequency)))
+
+    def _write_samples(self, samples):
+        self._wave.writeframes(_float_to_pcm(samples, self._sample_width))
+
+    def _close(self):
+        self._wave.close()
+
+
+class PipeSinkBlock(SinkBlock):
+    """
+    Writes the input as samples of sample_dtype to a binary stream: an open file object
+    (e.g. sys.stdout.buffer) or path of a named pipe.
+    """
+    def __init__(self, config, stream, sample_dtype="float32", buffer_size=BUFFER_SIZE,
+                 transfer_size=TRANSFER_SIZE, name="Wyjście: potok"):
+        self._stream = stream
+        self._sample_dtype = np.dtype(sample_dtype)
+        super().__init__(config, buffer_size, transfer_size, name)
+
+    stream = parameter("_stream")
+
+    def _open(self):
+        self._file = open(self._stream, 'wb') if isinstance(self._stream, str) else self._stream
+
+    def _write_samples(self, samples):
+        self._file.write(np.asarray(samples, self._sample_dtype).tobytes())
+        self._file.flush()
+
+    def _close(self):
+        if isinstance(self._stream, str):
+            self._file.close()
+
+
+class SocketSinkBlock(PipeSinkBlock):
+    """
+    Sends the input as samples of sample_dtype to a socket connected to address: path of a UNIX socket
+    or (host, port) of a TCP server.
+    """
+    def __init__(self, config, address, sample_dtype="float32", buffer_size=BUFFER_SIZE,
+                 transfer_size=TRANSFER_SIZE, name="Wyjście: gniazdo"):
+        self._address = address
+        super().__init__(config, None, sample_dtype, buffer_size, transfer_size, name)
+
+    address = parameter("_address")
+
+    def _open(self):
+        self._socket = _connect(self._address)
+        self._file = self._socket.makefile('wb')
+
+    def _close(self):
+        self._file.close()
+        self._socket.close()
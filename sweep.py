@@ -0,0 +1,70 @@
+import csv
+import itertools
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from scenario import pm_system, mse
+
+__author__ = 'Wojciech Urbański'
+
+
+def parameter_grid(**axes):
+    """
+    Creates list of parameter sets from every combination of given values, e.g.
+    parameter_grid(snr=[5, 10, 15], phase_dev=[0.5, 1, 2]).
+    """
+    names = sorted(axes)
+    return [dict(zip(names, values)) for values in itertools.product(*(axes[name] for name in names))]
+
+
+def _run_point(task):
+    index, parameters, seed, cache_dir = task
+    start = time.perf_counter()
+    cpu_start = time.process_time()
+    config = pm_system(seed=seed, cache_dir=cache_dir, **parameters)
+    row = dict(parameters)
+    # Only scalar metrics go back to the parent process, signals stay in the worker; with trials they are averaged
+    row.update(index=index, seed=seed, mse=float(np.mean(mse(config))),
+               snr_achieved=float(np.mean(config.blocks[2].get_snr())),
+               wall_time=time.perf_counter() - start, cpu_time=time.process_time() - cpu_start,
+               worker=os.getpid())
+    return row
+
+
+def sweep(grid, jobs=None, seed=0, cache_dir=None):
+    """
+    Runs the headless PMApplication chain for every parameter set in grid on a process pool.
+    Every point gets its own seed derived from seed, so results do not depend on jobs or scheduling.
+    With cache_dir, stages already computed by this or earlier sweeps are loaded instead of recomputed.
+    Returns a list of rows (dicts) with the parameters, mse, snr_achieved and timing; for points with trials
+    mse and snr_achieved are means over the trials.
+    """
+    grid = list(grid)
+    seeds = [int(child.generate_state(1)[0]) for child in np.random.SeedSequence(seed).spawn(len(grid))]
+    tasks = [(index, point, point_seed, cache_dir) for index, (point, point_seed) in enumerate(zip(grid, seeds))]
+    if jobs == 1:
+        return [_run_point(task) for task in tasks]
+    jobs = jobs or os.cpu_count()
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        return list(executor.map(_run_point, tasks, chunksize=max(1, len(tasks) // (4 * jobs))))
+
+
+def write_csv(rows, path):
+    if not rows:
+        return
+    columns = list(rows[0])
+    with open(path, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=columns)
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+if __name__ == '__main__':
+    results = sweep(parameter_grid(snr=[0, 5, 10, 15, 20, 25], phase_dev=[0.5, 1, 2]))
+    print("%6s %6s %12s %12s %10s" % ("snr", "dev", "MSE", "SNR [dB]", "czas [s]"))
+    for result in results:
+        print("%6.1f %6.2f %12.6f %12.2f %10.3f" % (result['snr'], result['phase_dev'], result['mse'],
+                                                    result['snr_achieved'], result['wall_time']))
@@ -1,16 +1,43 @@
+import os
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 import numpy as np
+from numpy.lib.format import open_memmap
 from blocks import Block
+from noise import BIT_GENERATORS
+from streamio import SourceBlock, SinkBlock, StreamStats
+from signals import Signal
 
 __author__ = 'Wojciech Urbański'
 
 
 class SystemConfiguration():
-    blocks = []
-
-    def __init__(self, time=1, sample_frequency=1, phase_dev=1):
+    def __init__(self, time=1, sample_frequency=1, phase_dev=1, trials=None, scratch_dir=None, dtype=np.float64,
+                 cache=None, seed=None, bit_generator="PCG64"):
+        self.blocks = []
+        # Precision of every signal in the system, float32 halves memory traffic
+        self._dtype = np.dtype(dtype)
+        if self._dtype not in (np.float32, np.float64):
+            raise ValueError("Nieobsługiwana precyzja obliczeń: %s" % self._dtype)
         self.time = time
         self.sample_frequency = sample_frequency
-        self.timeline = np.arange(0, time, 1 / sample_frequency)
+        self._timeline = None
+        # Number of Monte-Carlo trials simulated at once as leading axis of noisy signals, None for a single run
+        self.trials = trials
+        # Block outputs are kept in memory-mapped .npy files in this directory instead of RAM, if set
+        self.scratch_dir = scratch_dir
+        # Objects with pre_process(block, mode, input) and post_process(block, mode, input, output) methods,
+        # called around every block invocation; nothing is called when the list is empty
+        self.hooks = []
+        # ResultCache shared between runs, reproducible block outputs are taken from it instead of being computed
+        self.cache = cache
+        # Root of all random streams in the system, noise blocks spawn their child sequences from it
+        if bit_generator not in BIT_GENERATORS:
+            raise ValueError("Nieobsługiwany generator liczb losowych: %s" % bit_generator)
+        self._bit_generator = bit_generator
+        self._seed = seed
+        self._seed_sequence = np.random.SeedSequence(seed)
 
     def __iter__(self):
         return self.blocks.__iter__()
@@ -23,6 +50,12 @@ class SystemConfiguration():
         else:
             self.blocks.append(block)
 
+    def add_hook(self, hook):
+        self.hooks.append(hook)
+
+    def remove_hook(self, hook):
+        self.hooks.remove(hook)
+
     def add_blocks(self, blocks):
         for block in blocks:
             self.add_block(block)
@@ -33,11 +66,237 @@ class SystemConfiguration():
             for i, block in enumerate(self.blocks):
                 print("%2d: %s" % (i, block.name))
 
-    def connect_blocks(self):
+    def connect_blocks(self, verbose=True):
         for i in range(1, len(self.blocks)):
-            print("%d %s - %d %s" % (i - 1, self.blocks[i - 1].name, i, self.blocks[i].name))
+            if verbose:
+                print("%d %s - %d %s" % (i - 1, self.blocks[i - 1].name, i, self.blocks[i].name))
             self.blocks[i].connect(self.blocks[i - 1])
 
+    def connect(self, source, target, output="output", input="input"):
+        """
+        Connects named output of source block to named input of target block, adding both to the system.
+        """
+        for block in (source, target):
+            if block not in self.blocks:
+                self.add_block(block)
+        target.connect(source, input, output)
+
+    def graph(self):
+        """
+        Block graph as a dictionary mapping every block to the list of blocks connected to its inputs.
+        """
+        return {block: block.upstream for block in self.topological_order()}
+
+    def topological_order(self, targets=None):
+        """
+        Blocks needed to compute targets (all blocks by default), every block placed after its inputs.
+        """
+        targets = self.blocks if targets is None else targets
+        needed = []
+        stack = list(targets)
+        while stack:
+            block = stack.pop()
+            if block not in needed:
+                needed.append(block)
+                stack.extend(block.upstream)
+        waiting = {block: len(block.upstream) for block in needed}
+        ready = [block for block in needed if waiting[block] == 0]
+        order = []
+        while ready:
+            block = ready.pop(0)
+            order.append(block)
+            for child in block.downstream:
+                if child in waiting:
+                    waiting[child] -= 1
+                    if waiting[child] == 0:
+                        ready.append(child)
+        if len(order) != len(needed):
+            raise ValueError("Graf bloków zawiera cykl.")
+        return order
+
+    def execute(self, targets=None, jobs=None):
+        """
+        Computes outputs of targets (all blocks by default) in topological order. Independent branches run
+        concurrently on a thread pool of jobs threads, NumPy and SciPy release the GIL in FFT and filtering.
+        Every block is computed once, even if it feeds several branches.
+        """
+        order = self.topological_order(targets)
+        if jobs == 1:
+            for block in order:
+                block.outputs
+            return
+        waiting = {block: len(block.upstream) for block in order}
+        ready = [block for block in order if waiting[block] == 0]
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            running = {}
+            while ready or running:
+                for block in ready:
+                    running[executor.submit(lambda block: block.outputs, block)] = block
+                ready = []
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    block = running.pop(future)
+                    future.result()
+                    for child in block.downstream:
+                        if child in waiting:
+                            waiting[child] -= 1
+                            if waiting[child] == 0:
+                                ready.append(child)
+
+    def iter_timeline(self, chunk_size=4096):
+        """
+        Generates the timeline in chunks of at most chunk_size samples.
+        """
+        if chunk_size < 1:
+            raise ValueError("Rozmiar bloku próbek musi być większy niż 0.")
+        for start in range(0, self.length, chunk_size):
+            timeline = np.arange(start, min(start + chunk_size, self.length)) / self.sample_frequency
+            yield timeline.astype(self.dtype, copy=False)
+
+    def run_chunked(self, chunk_size=4096):
+        """
+        Runs the block chain in streaming mode, yielding timeline chunk and a list of block output chunks.
+        Memory usage depends only on chunk_size, not on simulation time.
+        """
+        for block in self.blocks:
+            block.reset()
+        try:
+            for timeline in self.iter_timeline(chunk_size):
+                chunk = np.zeros(timeline.shape, self.dtype)
+                outputs = []
+                for block in self.blocks:
+                    chunk = block.process_chunk(chunk)
+                    outputs.append(chunk)
+                yield timeline, outputs
+        finally:
+            for block in self.blocks:
+                block.close()
+
+    def run_stream(self, chunk_size=4096, duration=None):
+        """
+        Runs the block chain in streaming mode without a fixed timeline: until a source block reaches the end
+        of its stream or, if given, for duration seconds of signal. Sources should be placed before the blocks
+        they feed. Yields timeline chunk and a list of block output chunks like run_chunked(); throughput,
+        latency and buffer usage of the run are collected in stream_stats.
+        """
+        if chunk_size < 1:
+            raise ValueError("Rozmiar bloku próbek musi być większy niż 0.")
+        sources = [block for block in self.blocks if isinstance(block, SourceBlock)]
+        if duration is None and not sources:
+            raise ValueError("Strumień bez bloku źródłowego wymaga podania czasu trwania.")
+        limit = None if duration is None else int(np.ceil(duration * self.sample_frequency))
+        for block in self.blocks:
+            block.reset()
+        self.stream_stats = StreamStats()
+        start = 0
+        try:
+            while limit is None or start < limit:
+                count = chunk_size if limit is None else min(chunk_size, limit - start)
+                began = time.perf_counter()
+                chunk = np.zeros(count, self.dtype)
+                outputs = []
+                length = count
+                for block in self.blocks:
+                    chunk = block.process_chunk(chunk)
+                    outputs.append(chunk)
+                    if block in sources:
+                        length = min(length, chunk.shape[-1])
+                    if length == 0:
+                        break
+                if length == 0:
+                    break
+                arrivals = [source.arrival for source in sources if source.arrival is not None]
+                self.stream_stats.record(length, min(arrivals + [began]))
+                timeline = np.arange(start, start + length) / self.sample_frequency
+                yield timeline.astype(self.dtype, copy=False), outputs
+                start += length
+                if length < count:
+                    break
+        finally:
+            for block in self.blocks:
+                block.close()
+            self.stream_stats.buffers = {block.name: block.buffer_stats for block in self.blocks
+                                         if isinstance(block, (SourceBlock, SinkBlock))}
+
+    def _scratch_path(self, block, suffix=""):
+        os.makedirs(self.scratch_dir, exist_ok=True)
+        index = self.blocks.index(block) if block in self.blocks else id(block)
+        return os.path.join(self.scratch_dir, "%s_%s%s.npy" % (index, type(block).__name__, suffix))
+
+    def _temporary_path(self, path):
+        # Files are written under a unique name and renamed over the old ones, signals already memory-mapped
+        # from the old files keep their samples instead of seeing them overwritten or truncated
+        root, extension = os.path.splitext(path)
+        return "%s.tmp.%s%s" % (root, uuid.uuid4().hex, extension)
+
+    def store(self, block, signal, suffix=""):
+        """
+        Moves signal produced by block to the scratch directory and returns Signal backed by a read-only memmap,
+        or returns signal unchanged when scratch_dir is not set.
+
+        :rtype : Signal
+        """
+        if self.scratch_dir is None:
+            return signal
+        path = self._scratch_path(block, suffix)
+        temporary = self._temporary_path(path)
+        signal.save(temporary)
+        os.replace(temporary, path)
+        return Signal.load(path, signal.sample_frequency)
+
+    def run_to_disk(self, chunk_size=4096):
+        """
+        Runs the chain in streaming mode writing every block output straight into a .npy file in scratch_dir,
+        afterwards block outputs are memory-mapped from these files. Neither the chain nor its outputs
+        have to fit in memory.
+        """
+        if self.scratch_dir is None:
+            raise ValueError("Katalog roboczy (scratch_dir) nie został ustawiony.")
+        files = None
+        # Blocks changing the sample rate produce a different number of samples than the timeline
+        lengths = []
+        length = self.length
+        for block in self.blocks:
+            length = block.output_length(length)
+            lengths.append(length)
+        starts = [0] * len(self.blocks)
+        paths = [self._scratch_path(block) for block in self.blocks]
+        temporaries = [self._temporary_path(path) for path in paths]
+        try:
+            for timeline, outputs in self.run_chunked(chunk_size):
+                if files is None:
+                    files = [open_memmap(temporary, mode='w+', dtype=output.dtype,
+                                         shape=output.shape[:-1] + (length,))
+                             for temporary, output, length in zip(temporaries, outputs, lengths)]
+                for i, (file, output) in enumerate(zip(files, outputs)):
+                    file[..., starts[i]:starts[i] + output.shape[-1]] = output
+                    starts[i] += output.shape[-1]
+            for file, temporary, path in zip(files or [], temporaries, paths):
+                file.flush()
+                os.replace(temporary, path)
+        finally:
+            for temporary in temporaries:
+                if os.path.exists(temporary):
+                    os.remove(temporary)
+        for block, path in zip(self.blocks, paths if files else []):
+            block.set_output(Signal.load(path, block.sample_frequency))
+
+    def spawn_seed_sequence(self):
+        """
+        New child of the system seed sequence, children are numbered in order of spawning.
+
+        :rtype : np.random.SeedSequence
+        """
+        return self._seed_sequence.spawn(1)[0]
+
+    @property
+    def seed(self):
+        return self._seed
+
+    @property
+    def bit_generator(self):
+        return self._bit_generator
+
     def get_block(self, i):
         """
         Gets block with specified index number from the system.
@@ -51,6 +310,32 @@ class SystemConfiguration():
         except TypeError:
             return None
 
+    @property
+    def length(self):
+        # Same number of samples as np.arange(0, time, 1 / sample_frequency)
+        return int(np.ceil(self.time / (1 / self.sample_frequency)))
+
+    def batch_shape(self, length):
+        return (length,) if self.trials is None else (self.trials, length)
+
+    @property
+    def shape(self):
+        return self.batch_shape(self.length)
+
+    @property
+    def timeline(self):
+        if self._timeline is None:
+            self._timeline = np.arange(0, self.time, 1 / self.sample_frequency).astype(self.dtype, copy=False)
+        return self._timeline
+
+    @property
+    def dtype(self):
+        return self._dtype
+
+    @property
+    def complex_dtype(self):
+        return np.result_type(self._dtype, np.complex64)
+
     @property
     def sample_frequency(self):
         return self._sample_frequency
@@ -60,6 +345,8 @@ class SystemConfiguration():
         if self.time < 1/sample_frequency:
             raise ValueError("Okres próbkowania nie może być mniejszy niż czas symulacji.")
         self._sample_frequency = sample_frequency
+        self._timeline = None
+        self._invalidate_blocks()
 
     @property
     def time(self):
@@ -69,4 +356,11 @@ class SystemConfiguration():
     def time(self, time):
         if 0 >= time:
             raise ValueError("Czas symulacji musi być dłuższy niż 0.")
-        self._time = time
\ No newline at end of file
+        self._time = time
+        self._timeline = None
+        self._invalidate_blocks()
+
+    def _invalidate_blocks(self):
+        # Every block depends on the timeline
+        for block in self.blocks:
+            block.invalidate()
\ No newline at end of file
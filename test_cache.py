@@ -0,0 +1,48 @@
+import os
+
+import numpy as np
+
+from cache import ResultCache
+from scenario import pm_system, mse
+from signals import Signal
+
+__author__ = 'Wojciech Urbański'
+
+
+def test_round_trip(tmp_path):
+    cache = ResultCache(str(tmp_path))
+    outputs = {"output": Signal(np.arange(10.0), 100), "noise": Signal(np.ones(10), 100)}
+    cache.put("key", outputs)
+    loaded = cache.get("key", 100)
+    assert sorted(loaded) == ["noise", "output"]
+    np.testing.assert_array_equal(loaded["output"].signal, np.arange(10.0))
+    assert cache.hits == 1
+
+
+def test_temporary_file_of_another_writer_is_not_a_hit(tmp_path):
+    cache = ResultCache(str(tmp_path))
+    # Saved by another worker, which has not renamed it yet
+    np.save(os.path.join(str(tmp_path), "key.output.tmp.0123abcd.npy"), np.zeros(10))
+    assert cache.get("key", 100) is None
+    assert cache.misses == 1
+
+
+def test_entry_without_manifest_is_not_a_hit(tmp_path):
+    cache = ResultCache(str(tmp_path))
+    # First of two outputs already renamed, the manifest is written only after the last one
+    np.save(os.path.join(str(tmp_path), "key.output.npy"), np.zeros(10))
+    assert cache.get("key", 100) is None
+
+
+def test_evicted_output_is_a_miss(tmp_path):
+    cache = ResultCache(str(tmp_path))
+    cache.put("key", {"output": Signal(np.zeros(10), 100), "noise": Signal(np.zeros(10), 100)})
+    os.remove(os.path.join(str(tmp_path), "key.noise.npy"))
+    assert cache.get("key", 100) is None
+
+
+def test_cached_system_gives_the_same_result(tmp_path):
+    first = mse(pm_system(seed=1, cache_dir=str(tmp_path)))
+    config = pm_system(seed=1, cache_dir=str(tmp_path))
+    np.testing.assert_array_equal(mse(config), first)
+    assert config.cache.hits > 0
@@ -0,0 +1,65 @@
+import numpy as np
+import pytest
+from scipy.signal import hilbert
+
+from filters import analytic_signal, fir_analytic_signal
+from scenario import pm_system
+
+__author__ = 'Wojciech Urbański'
+
+# Samples at both ends where the FFT padding and the FIR transformer are only approximate
+EDGE = 1024
+
+
+@pytest.fixture(scope="module")
+def system():
+    config = pm_system(seed=1)
+    config.execute()
+    return config
+
+
+@pytest.fixture(scope="module")
+def filtered(system):
+    return system.blocks[3].output.signal
+
+
+def reference_phase(x):
+    # Demodulator before the single-FFT path: two hilbert() calls, four full-length FFTs
+    return np.unwrap(np.angle(-hilbert(hilbert(x).imag)))
+
+
+def test_fft_analytic_signal_matches_double_hilbert(filtered):
+    phase = np.unwrap(np.angle(1j * analytic_signal(filtered, remove_dc=True)))
+    error = np.abs(phase - reference_phase(filtered))[EDGE:-EDGE]
+    assert np.max(error) < 3.5e-6
+
+
+def test_fir_analytic_signal_matches_double_hilbert(filtered):
+    phase = np.unwrap(np.angle(1j * fir_analytic_signal(filtered)))
+    error = np.abs(phase - reference_phase(filtered))[EDGE:-EDGE]
+    assert np.max(error) < 2.7e-3
+
+
+def test_analytic_signal_keeps_real_part_without_dc():
+    x = np.sin(2 * np.pi * 5 * np.arange(1000) / 1000) + 0.5
+    np.testing.assert_allclose(analytic_signal(x).real, x, atol=1e-12)
+    np.testing.assert_allclose(analytic_signal(x, remove_dc=True).real, x - 0.5, atol=1e-12)
+
+
+def test_demodulator_matches_previous_implementation(system, filtered):
+    demodulator = system.blocks[-1]
+    assert demodulator.method == 'fft'
+    timeline = np.arange(filtered.shape[-1]) / system.sample_frequency
+    expected = (reference_phase(filtered) - 2 * np.pi * demodulator.frequency * timeline) / demodulator.deviation
+    error = np.abs(demodulator.output.signal - expected)[EDGE:-EDGE]
+    assert np.max(error) < 3.5e-6 / demodulator.deviation
+
+
+def test_streamed_demodulator_output_is_delayed_by_reported_delay(system):
+    demodulator = system.blocks[-1]
+    delay = int(round(demodulator.delay + system.blocks[3].group_delay(demodulator.frequency)))
+    streamed = np.concatenate([outputs[-1] for _, outputs in system.run_chunked(1000)], axis=-1)
+    batch = demodulator.output.signal
+    aligned = np.mean((streamed[delay:] - batch[:-delay])[EDGE:] ** 2)
+    assert aligned < 0.05
+    assert aligned < np.mean((streamed - batch)[EDGE:] ** 2) / 10
@@ -0,0 +1,9 @@
+from benchmark import check_imports
+
+__author__ = 'Wojciech Urbański'
+
+
+def test_headless_modules_import_fast_without_heavy_modules():
+    results, failures = check_imports()
+    assert results
+    assert failures == []
@@ -0,0 +1,19 @@
+import json
+
+from main import main
+
+__author__ = 'Wojciech Urbański'
+
+
+def test_unreadable_scenario_file_is_reported_as_error_line(tmp_path, capsys):
+    broken = tmp_path / "broken.json"
+    broken.write_text("{")
+    valid = tmp_path / "valid.json"
+    valid.write_text(json.dumps({"seed": 1, "simulation_time": 0.1}))
+    assert main([str(tmp_path / "missing.json"), str(broken), str(valid), "-j", "1"]) == 1
+    results = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+    assert [result["file"] for result in results] == [str(tmp_path / name)
+                                                     for name in ("missing.json", "broken.json", "valid.json")]
+    assert results[0]["error"].startswith("FileNotFoundError")
+    assert results[1]["error"].startswith("JSONDecodeError")
+    assert "error" not in results[2]
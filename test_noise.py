@@ -0,0 +1,37 @@
+import numpy as np
+import pytest
+
+from noise import NoiseStream
+from scenario import pm_system
+
+__author__ = 'Wojciech Urbański'
+
+
+def chunked(config, chunk_size):
+    parts = [outputs for _, outputs in config.run_chunked(chunk_size)]
+    return [np.concatenate([part[i] for part in parts], axis=-1) for i in range(len(parts[0]))]
+
+
+@pytest.mark.parametrize("dtype", [np.float64, np.float32])
+def test_channel_output_does_not_depend_on_chunk_size(dtype):
+    reference = chunked(pm_system(seed=1, trials=2, dtype=dtype), 1000)
+    for chunk_size in (777, 40960):
+        outputs = chunked(pm_system(seed=1, trials=2, dtype=dtype), chunk_size)
+        np.testing.assert_array_equal(outputs[2], reference[2])
+
+
+def test_noise_stream_does_not_depend_on_chunk_size_or_trials():
+    sequence = np.random.SeedSequence(1)
+    whole = NoiseStream(sequence, trials=3).normal(200000)
+    stream = NoiseStream(sequence, trials=3)
+    parts = np.concatenate([stream.normal(count) for count in (1, 70000, 65535, 64464)], axis=-1)
+    np.testing.assert_array_equal(parts, whole)
+    np.testing.assert_array_equal(NoiseStream(sequence, trials=1).normal(1000), whole[:1, :1000])
+    stream.seek(123456)
+    np.testing.assert_array_equal(stream.normal(100), whole[:, 123456:123556])
+
+
+@pytest.mark.parametrize("dtype", [np.float64, np.float32])
+def test_channel_output_in_one_piece_matches_chunked_run(dtype):
+    config = pm_system(seed=1, trials=2, dtype=dtype)
+    np.testing.assert_array_equal(config.blocks[2].output.signal, chunked(config, 777)[2])
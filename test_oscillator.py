@@ -0,0 +1,19 @@
+import numpy as np
+
+from oscillator import NCO
+from scenario import pm_system, mse
+
+__author__ = 'Wojciech Urbański'
+
+
+def test_chain_does_not_build_timeline():
+    config = pm_system(seed=1)
+    mse(config)
+    assert config._timeline is None
+
+
+def test_nco_is_continuous_between_chunks():
+    whole = NCO(1234.5, 8000, phase=0.3).sin(10000)
+    nco = NCO(1234.5, 8000, phase=0.3)
+    parts = np.concatenate([nco.sin(count) for count in (1, 4999, 5000)])
+    np.testing.assert_array_equal(parts, whole)
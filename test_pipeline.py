@@ -0,0 +1,53 @@
+import asyncio
+
+import numpy as np
+import pytest
+
+from blocks import Block, SineGeneratorBlock, DifferenceBlock, LowPassFilterBlock
+from pipeline import AsyncPipeline, run_pipeline
+from system import SystemConfiguration
+
+__author__ = 'Wojciech Urbański'
+
+
+class FailingBlock(Block):
+    def __init__(self, config, after=0, name="Blok z błędem"):
+        self._after = after
+        super().__init__(config, name)
+
+    def reset(self):
+        self._chunks = 0
+
+    def _process_chunk(self, chunk):
+        self._chunks += 1
+        if self._chunks > self._after:
+            raise RuntimeError("awaria bloku")
+        return chunk
+
+
+def chain(middle):
+    config = SystemConfiguration(1, 6400)
+    config.add_blocks([SineGeneratorBlock(config, 10), middle(config), LowPassFilterBlock(config, high_freq=100)])
+    config.connect_blocks(verbose=False)
+    return config
+
+
+def test_block_without_streaming_support_raises():
+    with pytest.raises(NotImplementedError):
+        run_pipeline(chain(DifferenceBlock), chunk_size=1000, duration=1)
+
+
+@pytest.mark.parametrize("after", [0, 3])
+def test_failing_stage_raises_instead_of_hanging(after):
+    with pytest.raises(RuntimeError, match="awaria bloku"):
+        run_pipeline(chain(lambda config: FailingBlock(config, after)), chunk_size=500, queue_size=1, duration=1)
+
+
+def test_pipeline_matches_chunked_run():
+    config = chain(lambda config: FailingBlock(config, after=100))
+    expected = np.concatenate([outputs[-1] for _, outputs in config.run_chunked(1000)], axis=-1)
+
+    async def collect():
+        return [chunk async for _, chunk in AsyncPipeline(config, chunk_size=1000, duration=1).stream()]
+
+    np.testing.assert_array_equal(np.concatenate(asyncio.run(collect()), axis=-1), expected)
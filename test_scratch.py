@@ -0,0 +1,37 @@
+import os
+
+import numpy as np
+
+from scenario import pm_system
+
+__author__ = 'Wojciech Urbański'
+
+
+def test_recompute_keeps_earlier_outputs(tmp_path):
+    config = pm_system(seed=1, scratch_dir=str(tmp_path))
+    old = config.blocks[-1].output
+    expected = np.array(old.signal)
+    # Shorter simulation, an output overwritten in place would be truncated under the old memmap
+    config.time = 0.5
+    config.blocks[-1].output
+    np.testing.assert_array_equal(old.signal, expected)
+
+
+def test_parameter_change_keeps_earlier_outputs(tmp_path):
+    config = pm_system(seed=1, scratch_dir=str(tmp_path))
+    old = config.blocks[2].output
+    expected = np.array(old.signal)
+    config.blocks[2].snr = 5
+    assert not np.array_equal(config.blocks[2].output.signal, expected)
+    np.testing.assert_array_equal(old.signal, expected)
+
+
+def test_run_to_disk_keeps_earlier_outputs(tmp_path):
+    config = pm_system(seed=1, scratch_dir=str(tmp_path))
+    config.run_to_disk(1000)
+    old = config.blocks[-1].output
+    expected = np.array(old.signal)
+    config.time = 0.5
+    config.run_to_disk(1000)
+    np.testing.assert_array_equal(old.signal, expected)
+    assert not [name for name in os.listdir(str(tmp_path)) if ".tmp." in name]
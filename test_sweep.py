@@ -0,0 +1,13 @@
+import numpy as np
+
+from scenario import pm_system, mse
+from sweep import sweep
+
+__author__ = 'Wojciech Urbański'
+
+
+def test_sweep_averages_trials():
+    rows = sweep([{'snr': 10, 'trials': 4}], jobs=1)
+    config = pm_system(seed=rows[0]['seed'], snr=10, trials=4)
+    assert rows[0]['mse'] == float(np.mean(mse(config)))
+    assert rows[0]['snr_achieved'] == float(np.mean(config.blocks[2].get_snr()))